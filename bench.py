@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import glob
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import socket
+import statistics
+import tempfile
+import time
+import yaml
+
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from aiohttp import web
+
+SITE_CONFIGS = './configs/site_configurations/news'
+
+# Вид ссылок на статьи для сайтов из конфигураций (совпадает с регулярными выражениями сайтов)
+ARTICLE_SHAPES = {
+    'lenta.ru': 'news/{date:%Y/%m/%d}/article-{number}/',
+    '3dnews.ru': '{id}/article-{number}',
+    'ria.ru': '{date:%Y%m%d}/article-{number}.html',
+    'kuban.rbc.ru': 'news/{id}-article-{number}',
+}
+DEFAULT_SHAPE = '{id}/article-{number}'
+
+
+# -- Simulated news server ---------------------------------------------------------------------------------------------
+class NewsSimulator:
+    """
+    Локальный сервер, имитирующий новостные сайты из конфигураций: главные страницы
+    со ссылками в разметке, которую ожидает конфигурация сайта, и страницы статей.
+    Новые статьи появляются с заданной частотой, главная страница поддерживает ETag.
+    """
+
+    def __init__(self, site_configs, links=60, new_per_second=1.0, latency=0.05, latency_jitter=0.5,
+                 article_size=60 * 1024, error_rate=0.0, seed=0):
+        """
+        :param dict site_configs: Конфигурации сайтов по названиям папок
+        :param int links: Количество ссылок на главной странице
+        :param float new_per_second: Частота появления новых статей на каждом сайте
+        :param float latency: Средняя задержка ответа в секундах
+        :param float latency_jitter: Разброс задержки (доля от *latency*)
+        :param int article_size: Размер страницы статьи в байтах
+        :param float error_rate: Доля ответов с ошибкой 500
+        :param int seed: Начальное значение генератора случайных чисел
+        """
+        self.site_configs = site_configs
+        self.links = links
+        self.new_per_second = new_per_second
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.article_size = article_size
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.started = time.monotonic()
+        paragraph = '<p>' + 'Съешь же ещё этих мягких французских булок, да выпей чаю. ' * 8 + '</p>\n'
+        self.paragraphs = paragraph * max(1, article_size // len(paragraph.encode('utf-8')))
+
+    def application(self):
+        app = web.Application()
+        app.router.add_get('/{site}', self.handle)
+        app.router.add_get('/{site}/{path:.*}', self.handle)
+        return app
+
+    async def delay(self):
+        jitter = self.latency * self.latency_jitter
+        await asyncio.sleep(max(0.0, self.random.uniform(self.latency - jitter, self.latency + jitter)))
+
+    def latest(self):
+        return int((time.monotonic() - self.started) * self.new_per_second) + self.links
+
+    def article_path(self, site, number):
+        shape = ARTICLE_SHAPES.get(site, DEFAULT_SHAPE)
+        return shape.format(date=datetime.now(), id=1000000 + number, number=number)
+
+    def front_page(self, request, site, site_config):
+        latest = self.latest()
+        etag = f'"{site}-{latest}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+
+        tag = site_config.get('tag', 'a')
+        tag_class = site_config.get('tag_class', None)
+        class_attribute = f' class="{tag_class}"' if tag_class else ''
+        base = f'{request.scheme}://{request.host}/{site}'
+        items = []
+        for number in range(latest - self.links, latest):
+            items.append(f'<div class="item"><{tag}{class_attribute} href="{base}/{self.article_path(site, number)}">'
+                         f'Новость {number}</{tag}></div>')
+            # Ссылки, которые не должны попасть в список статей
+            items.append('<a href="/about">О проекте</a>')
+        body = f'<html><head><title>{site}</title></head><body>{"".join(items)}</body></html>'
+        return web.Response(text=body, content_type='text/html', headers={'ETag': etag})
+
+    async def handle(self, request):
+        await self.delay()
+        site = request.match_info['site']
+        site_config = self.site_configs.get(site)
+        if site_config is None:
+            raise web.HTTPNotFound()
+        if self.random.random() < self.error_rate:
+            raise web.HTTPInternalServerError()
+        if request.path.rstrip('/') == urlparse(site_config['url']).path.rstrip('/'):
+            return self.front_page(request, site, site_config)
+        body = (f'<html><head><title>{request.path}</title></head><body><article><h1>{request.path}</h1>'
+                f'{self.paragraphs}</article></body></html>')
+        return web.Response(text=body, content_type='text/html')
+
+
+def run_simulator(port, site_configs, options):
+    simulator = NewsSimulator(site_configs, **options)
+    web.run_app(simulator.application(), host='127.0.0.1', port=port, print=None)
+
+
+# -- Benchmarks --------------------------------------------------------------------------------------------------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.05)
+    raise TimeoutError(f'Сервер не запустился на порту {port}')
+
+
+def local_site_configs(port, args):
+    """
+    Загружает конфигурации сайтов и перенаправляет их на локальный сервер.
+    """
+    site_configs = {}
+    for path in sorted(glob.glob(f'{args.site_configs}/*.yaml')):
+        with open(path) as stream:
+            site_config = yaml.safe_load(stream)['site_config']
+        site = site_config['folder']
+        origin = '{0.scheme}://{0.netloc}'.format(urlparse(site_config['url']))
+        local_origin = f'http://127.0.0.1:{port}/{site}'
+        site_config['url'] = site_config['url'].replace(origin, local_origin)
+        if site_config.get('regular'):
+            site_config['regular'] = site_config['regular'].replace(origin, local_origin)
+        site_config.pop('feed', None)
+        site_config.pop('adaptive', None)
+        site_config['time_update'] = {'hours': 0, 'minutes': 0, 'seconds': args.refresh}
+        site_config['politeness'] = {'concurrency': args.concurrency, 'rate': args.rate, 'burst': args.concurrency}
+        site_configs[site] = site_config
+    return site_configs
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def bench_crawl(args):
+    """
+    Запускает скрапер против локального сервера и измеряет производительность загрузки статей
+    (задержка - время загрузки и сохранения статьи без ожидания политики вежливости).
+    """
+    from scraper import Scraper
+
+    class BenchScraper(Scraper):
+        latencies = []
+        pages = 0
+
+        async def download(self, url=None, site_config=None, main_page=False):
+            started = time.perf_counter()
+            path = await super().download(url=url, site_config=site_config, main_page=main_page)
+            self.latencies.append(time.perf_counter() - started)
+            if path is not None:
+                BenchScraper.pages += 1
+            return path
+
+    port = free_port()
+    site_configs = local_site_configs(port, args)
+    options = {
+        'links': args.links,
+        'new_per_second': args.new_per_second,
+        'latency': args.latency,
+        'article_size': args.size,
+        'error_rate': args.error_rate,
+    }
+    server = multiprocessing.get_context('spawn').Process(target=run_simulator, args=(port, site_configs, options))
+    server.start()
+    workdir = tempfile.mkdtemp(prefix='reloc_bench_')
+    cwd = os.getcwd()
+    try:
+        wait_for_port(port)
+        os.makedirs(f'{workdir}/configs/site_configurations/bench')
+        for site, site_config in site_configs.items():
+            with open(f'{workdir}/configs/site_configurations/bench/{site}.yaml', 'w') as stream:
+                yaml.safe_dump({'site_config': site_config}, stream)
+        scraper_config = {
+            'root_folder': 'site_configurations',
+            'config_folder': 'bench',
+            'user-agent': 'reloc-bench',
+            'site_list': list(site_configs),
+            'storage': {'compression': args.compression, 'format': args.format},
+        }
+        with open(f'{workdir}/configs/bench.yaml', 'w') as stream:
+            yaml.safe_dump(scraper_config, stream)
+
+        os.chdir(workdir)
+        scraper = BenchScraper('./configs/bench.yaml')
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        asyncio.run(scraper.start_page_refresh(end_time=datetime.now() + timedelta(seconds=args.duration)))
+        elapsed = time.perf_counter() - started
+        finished = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        server.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    cpu = (finished.ru_utime - usage.ru_utime) + (finished.ru_stime - usage.ru_stime)
+    latencies = BenchScraper.latencies
+    return {
+        'sites': len(site_configs),
+        'pages': BenchScraper.pages,
+        'requests': len(latencies),
+        'secs': elapsed,
+        'pages_per_sec': BenchScraper.pages / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        'cpu_ms_per_page': cpu * 1000 / BenchScraper.pages if BenchScraper.pages else 0.0,
+        'max_rss_mb': finished.ru_maxrss / 1024,
+    }
+
+
+def bench_extract(args):
+    """
+    Измеряет скорость извлечения ссылок с главных страниц без сети.
+    """
+    from scraper import LinkExtractor
+
+    class Request:
+        scheme = 'http'
+        host = '127.0.0.1:0'
+        headers = {}
+
+    site_configs = local_site_configs(0, args)
+    simulator = NewsSimulator(site_configs, links=args.links)
+    result = {}
+    for site, site_config in site_configs.items():
+        page = simulator.front_page(Request(), site, site_config).body
+        extractor = LinkExtractor(site_config)
+        links = extractor.extract(page)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            extractor.extract(page)
+        elapsed = time.perf_counter() - started
+        result[site] = {
+            'links': len(links),
+            'page_kb': len(page) / 1024,
+            'pages_per_sec': args.repeat / elapsed,
+        }
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование скрапера на локальном сервере')
+    parser.add_argument('mode', choices=['crawl', 'extract'], nargs='?', default='crawl')
+    parser.add_argument('--site-configs', default=SITE_CONFIGS, help='Каталог с конфигурациями сайтов')
+    parser.add_argument('--duration', type=float, default=30, help='Длительность теста в секундах')
+    parser.add_argument('--refresh', type=int, default=5, help='Интервал обновления главных страниц в секундах')
+    parser.add_argument('--links', type=int, default=60, help='Количество ссылок на главной странице')
+    parser.add_argument('--new-per-second', type=float, default=1.0, help='Частота появления новых статей')
+    parser.add_argument('--latency', type=float, default=0.05, help='Средняя задержка ответа сервера в секундах')
+    parser.add_argument('--size', type=int, default=60 * 1024, help='Размер страницы статьи в байтах')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов с ошибкой 500')
+    parser.add_argument('--concurrency', type=int, default=4, help='Одновременных запросов к одному хосту')
+    parser.add_argument('--rate', type=float, default=50, help='Запросов в секунду к одному хосту')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None)
+    parser.add_argument('--format', choices=['files', 'archive'], default='files')
+    parser.add_argument('--repeat', type=int, default=200, help='Количество повторов для режима extract')
+    arguments = parser.parse_args()
+
+    results = bench_crawl(arguments) if arguments.mode == 'crawl' else bench_extract(arguments)
+    print(yaml.safe_dump(results, allow_unicode=True, sort_keys=False))
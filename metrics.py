@@ -0,0 +1,247 @@
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# -- Metrics -----------------------------------------------------------------------------------------------------------
+class Metric:
+    """
+    Базовый класс метрики в формате Prometheus. Значения хранятся по наборам меток.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        """
+        :param str name: Название метрики
+        :param str documentation: Описание метрики (строка HELP)
+        :param labelnames: Названия меток метрики
+        :param Registry registry: Реестр, в котором регистрируется метрика (по умолчанию REGISTRY)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, **labels):
+        """
+        Возвращает метрику для указанного набора меток.
+        """
+        return _Child(self, tuple(str(labels[name]) for name in self.labelnames))
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = [f'{name}="{_escape(value)}"' for name, value in pairs]
+        return '{' + ','.join(escaped) + '}'
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield f'{self.name}{self._format_labels(key)} {_format_value(value)}'
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class _Child:
+    """
+    Метрика с зафиксированным набором меток.
+    """
+
+    def __init__(self, metric, key):
+        self.metric = metric
+        self.key = key
+
+    def __getattr__(self, item):
+        method = getattr(self.metric, item)
+        return lambda *args, **kwargs: method(*args, key=self.key, **kwargs)
+
+
+class Counter(Metric):
+    """
+    Монотонно возрастающий счётчик.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, key=()):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Произвольное значение, которое может увеличиваться и уменьшаться.
+    Значение можно вычислять в момент сбора метрик (*set_function*).
+    """
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.functions = {}
+
+    def set(self, value, key=()):
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, key=()):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, key=()):
+        self.inc(-amount, key=key)
+
+    def set_function(self, function, key=()):
+        """
+        Задаёт функцию, которая вычисляет значение метрики при каждом сборе.
+        """
+        with self.lock:
+            self.functions[key] = function
+
+    def remove(self, key=()):
+        with self.lock:
+            self.values.pop(key, None)
+            self.functions.pop(key, None)
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+        for key, function in functions.items():
+            values[key] = function()
+        for key, value in sorted(values.items()):
+            if value is not None:
+                yield f'{self.name}{self._format_labels(key)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    """
+    Гистограмма значений с накопительными корзинами.
+    """
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, key=()):
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, key=()):
+        """
+        Контекстный менеджер, измеряющий время выполнения блока.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, key=key)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                labels = self._format_labels(key, ('le', _format_value(bound)))
+                yield f'{self.name}_bucket{labels} {count}'
+            yield f'{self.name}_sum{self._format_labels(key)} {_format_value(total)}'
+            yield f'{self.name}_count{self._format_labels(key)} {counts[-1]}'
+
+
+class Registry:
+    """
+    Реестр метрик, формирующий ответ в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def expose(self):
+        """
+        Возвращает все метрики в текстовом формате Prometheus.
+        """
+        return '\n'.join(metric.expose() for metric in self.metrics) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# -- Scraper metrics ---------------------------------------------------------------------------------------------------
+REQUEST_LATENCY = Histogram('scraper_request_duration_seconds',
+                            'Время загрузки страницы (от запроса до получения всего тела ответа)',
+                            labelnames=('host',))
+STORAGE_LATENCY = Histogram('scraper_storage_duration_seconds',
+                            'Время сжатия и записи скачиваемой страницы (не входит в время загрузки)',
+                            labelnames=('host',))
+RESPONSES = Counter('scraper_responses_total',
+                    'Количество ответов по хостам и кодам состояния (error - ошибка соединения)',
+                    labelnames=('host', 'status'))
+DOWNLOADED_BYTES = Counter('scraper_downloaded_bytes_total',
+                           'Количество скачанных байт тела ответов',
+                           labelnames=('host',))
+NEW_LINKS = Counter('scraper_new_links_total',
+                    'Количество новых ссылок, найденных на главных страницах',
+                    labelnames=('site',))
+LAST_NEW_LINKS = Gauge('scraper_last_refresh_new_links',
+                       'Количество новых ссылок, найденных при последнем обновлении сайта',
+                       labelnames=('site',))
+REFRESHES = Counter('scraper_refreshes_total',
+                    'Количество обновлений главных страниц (result: updated, unchanged)',
+                    labelnames=('site', 'result'))
+QUEUE_DEPTH = Gauge('scraper_queue_depth',
+                    'Количество сайтов, ожидающих свободного обработчика')
+SCHEDULED_SITES = Gauge('scraper_scheduled_sites',
+                        'Количество сайтов в расписании обновлений')
+NEXT_REFRESH = Gauge('scraper_next_refresh_seconds',
+                     'Время до следующего обновления сайта в секундах',
+                     labelnames=('site',))
+REFRESH_INTERVAL = Gauge('scraper_refresh_interval_seconds',
+                         'Текущий интервал обновления сайта в секундах',
+                         labelnames=('site',))
+
+
+# -- Pipeline metrics --------------------------------------------------------------------------------------------------
+PIPELINE_QUEUE_DEPTH = Gauge('pipeline_queue_depth',
+                             'Количество скачанных страниц, ожидающих предварительной обработки')
+PIPELINE_DOCUMENTS = Counter('pipeline_documents_total',
+                             'Количество страниц, прошедших потоковую обработку '
+                             '(result: processed, skipped, retried, error)',
+                             labelnames=('result',))
+PIPELINE_LATENCY = Histogram('pipeline_latency_seconds',
+                             'Время от сохранения страницы до готовности результата обработки')
@@ -1,18 +1,27 @@
-import json
+import hashlib
+import itertools
+import multiprocessing
 import os.path
 import pickle
+import shutil
+import tempfile
 import time
-import pandas as pd
+import zipfile
+from collections import Counter
 
-import nltk
 from docx import Document
+from openpyxl import Workbook
 from nltk.corpus.reader.api import CorpusReader, CategorizedCorpusReader
 from nltk.corpus.reader.plaintext import CategorizedPlaintextCorpusReader, sent_tokenize
-from nltk import wordpunct_tokenize, pos_tag
+from nltk import wordpunct_tokenize
+from nltk.tag.perceptron import PerceptronTagger
 from readability.readability import Unparseable
 from readability.readability import Document as Paper
 import bs4
 
+from storage import (COMPRESSION_EXTENSIONS, CorpusManifest, DocumentCache, ProcessingManifest, SegmentArchive,
+                     TokenDocument, Vocabulary, merge_counts, open_page, write_counts, write_tokens, write_vocabulary)
+
 # import nltk
 
 # nltk.download('punkt')
@@ -22,19 +31,211 @@ import bs4
 CAT_PATTERN = r'([\w_\s\.]+)/.*'
 DOC_PATTERN = r'(?!\.)[\w_\s]+/[\w\s\d\-]+\.txt'
 # HTML_PATTERN = r'(?!\.)[/\w_\s]+[/\w+.-]*[\.html]+'
-HTML_PATTERN = r'.*[\.html]+'
+HTML_PATTERN = r'.*\.html(\.gz|\.zst)?$'
 # PKL_PATTERN = r'(?!\.)[a-z_\s]+/[a-f0-9]+\.pickle'
-PKL_PATTERN = r'.*[\.pickle]+'
+PKL_PATTERN = r'.*\.(pickle|tokens)'
 TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'h7', 'p', 'li']
 
 
 # TODO: Убрать дубликаты в коде, выделить в отдельные функции.
 #  P.S. Аккуратно с наследованием!
 
+# Символы, удаляемые из предложений при подсчёте слов в describe
+DESCRIBE_SYMBOLS = ['\n', ',', '.', '!', '?', ':', ';', '_', '#', '(', ')', '\\', '/', '⇡', '×', '«', '»', '—', '<',
+                    '>', '+', '[', ']', '👎', '❌', '🇵🇹', '🇦🇷', '🟢', '🔴', '⚪️', '\u200b', '…', '👌', '•\u200e', '"',
+                    '\u2009']
+
+
+def symbol_stripper(symbols):
+    """
+    Возвращает функцию, удаляющую символы *symbols* из строки (неразрывный пробел заменяется пробелом)
+    с тем же результатом, что последовательные вызовы str.replace в порядке списка. Подряд идущие
+    одиночные символы удаляются одним проходом str.translate, последовательности из нескольких
+    кодовых точек (флаги, символы с модификаторами) - заменой. Если в строке нет кодовых точек
+    последовательностей, все одиночные символы удаляются за один проход.
+    """
+    steps = []
+    table = {ord('\xa0'): ' '}
+    for symbol in symbols:
+        if len(symbol) == 1:
+            table[ord(symbol)] = None
+        elif symbol:
+            steps.extend([table, symbol])
+            table = {}
+    steps.append(table)
+
+    single = {}
+    for step in steps:
+        if isinstance(step, dict):
+            single.update(step)
+    sequence_chars = set(''.join(step for step in steps if isinstance(step, str)))
+
+    def strip(text):
+        if sequence_chars.isdisjoint(text):
+            return text.translate(single)
+        for step in steps:
+            if isinstance(step, dict):
+                text = text.translate(step)
+            elif step in text:
+                text = text.replace(step, '')
+        return text
+
+    return strip
+
+
+strip_describe_symbols = symbol_stripper(DESCRIBE_SYMBOLS)
+
+# Символы, удаляемые из предложений при построении словаря
+TOKEN_SYMBOLS = ['\n', ',', '.', '!', '?', ':', ';', '_', '#', '(', ')', '\\', '/', '⇡', '×', '«', '»', '—', '<', '>',
+                 '+', '%', '[', ']', '👎', '❌', '🇵🇹', '🇦🇷', '🟢', '🔴', '⚪️', '\u200b', '…', '👌', '•\u200e', '"',
+                 '\u2009', '£']
+strip_token_symbols = symbol_stripper(TOKEN_SYMBOLS)
+
+CYRILLIC_SYMBOLS = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя-'
+
+
 def iscyrillic(s):
-    cyrillic_symbols = set('абвгдеёжзийклмнопрстуфхцчшщъыьэюя-')
-    word_symbols = set(s.lower())
-    return word_symbols.difference(cyrillic_symbols) == set()
+    # Слово состоит только из кириллических символов, если после их удаления с краёв ничего не остаётся
+    return not s.lower().strip(CYRILLIC_SYMBOLS)
+
+
+def count_words(corpus, fileids, directory, max_words=500000):
+    """
+    Подсчитывает частоты кириллических слов (tf) и количество документов, в которых они
+    встречаются (df). Как только различных слов становится больше *max_words*, частичные
+    результаты, упорядоченные по слову, сбрасываются в файл в каталоге *directory*.
+
+    :return: Кортеж (список файлов частичных результатов, количество документов)
+    """
+    counts = {}
+    spills = []
+
+    def spill():
+        handle, path = tempfile.mkstemp(suffix='.counts', dir=directory)
+        os.close(handle)
+        write_counts(path, ((word, tf, df) for word, (tf, df) in sorted(counts.items())))
+        spills.append(path)
+        counts.clear()
+
+    for fileid in fileids:
+        document = Counter()
+        for para in corpus.paras(fileids=fileid):
+            for sent in sent_tokenize(para):
+                document.update(word for word in strip_token_symbols(sent).split(' ') if word and iscyrillic(word))
+        for word, tf in document.items():
+            total = counts.get(word)
+            counts[word] = (tf, 1) if total is None else (total[0] + tf, total[1] + 1)
+        if len(counts) > max_words:
+            spill()
+    if counts:
+        spill()
+    return spills, len(fileids)
+
+
+# Загруженные модели разметки частями речи: по одной на язык в каждом процессе
+_taggers = {}
+
+
+def get_tagger(lang='rus'):
+    """
+    Возвращает модель разметки частями речи для языка, загружая её один раз на процесс.
+    """
+    tagger = _taggers.get(lang)
+    if tagger is None:
+        tagger = _taggers[lang] = PerceptronTagger(lang=lang) if lang == 'rus' else PerceptronTagger()
+    return tagger
+
+
+def tag_paras(paras, lang='rus'):
+    """
+    Лексемизирует абзацы и размечает все их предложения частями речи одним пакетом
+    (аналогично pos_tag_sents) одной и той же моделью.
+
+    :param paras: Список абзацев
+    :return: Список абзацев, абзац - список предложений, предложение - список пар (слово, тег)
+    """
+    sents = [[wordpunct_tokenize(sent) for sent in sent_tokenize(para)] for para in paras]
+    tag = get_tagger(lang).tag
+    return [[tag(sent) for sent in para] for para in sents]
+
+
+def tag_stream(paras, lang='rus', batch_size=64):
+    """
+    Генератор размеченных абзацев для потока абзацев: абзацы размечаются пакетами по *batch_size*.
+    """
+    paras = iter(paras)
+    while True:
+        batch = list(itertools.islice(paras, batch_size))
+        if not batch:
+            return
+        yield from tag_paras(batch, lang)
+
+
+def summary(doc):
+    """
+    Очищает HTML документа с помощью библиотеки readability-lxml
+    (пустая строка, если страницу не удалось разобрать).
+    """
+    try:
+        return Paper(doc).summary()
+    except Unparseable as e:
+        print(f'Не могу распарсить HTML-страницу: {e}')
+        return ''
+
+
+def extract_paras(doc):
+    """
+    Выделяет абзацы из очищенного HTML документа. Использует библиотеку BeautifulSoup.
+    """
+    tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'h7', 'p', 'li']
+    html = summary(doc)
+    if not html:
+        return []
+    soup = bs4.BeautifulSoup(html, 'lxml')
+    paras = [element.text for element in soup.find_all(tags)]
+    soup.decompose()
+    return paras
+
+
+def empty_stats():
+    return {'paras': 0, 'sents': 0, 'words': 0, 'tokens': Counter()}
+
+
+def paras_stats(paras):
+    """
+    Вычисляет статистику документа по его абзацам: количества абзацев, предложений
+    и слов и частоты слов. Статистики разных документов объединяются *merge_stats*.
+    """
+    stats = {'paras': 0, 'sents': 0, 'words': 0, 'tokens': {}}
+    tokens = stats['tokens']
+    for para in paras:
+        stats['paras'] += 1
+        for sent in sent_tokenize(para):
+            stats['sents'] += 1
+            for word in strip_describe_symbols(sent).split(' '):
+                stats['words'] += 1
+                tokens[word] = tokens.get(word, 0) + 1
+    return stats
+
+
+def merge_stats(total, stats):
+    """
+    Добавляет статистику *stats* к накопленной статистике *total*.
+    """
+    for key in ('paras', 'sents', 'words'):
+        total[key] += stats[key]
+    total['tokens'].update(stats['tokens'])
+    return total
+
+
+def describe_chunk(reader, fileids):
+    """
+    Объединённая статистика группы документов корпуса.
+    """
+    total = empty_stats()
+    for stats in reader.stats(fileids):
+        merge_stats(total, stats)
+    return total
 
 
 class TXTCorpusReader(CategorizedPlaintextCorpusReader):
@@ -110,8 +311,7 @@ class TXTCorpusReader(CategorizedPlaintextCorpusReader):
                 yield token
 
     def tokenize(self, fileids=None, categories=None):
-        for paragraph in self.paras(fileids, categories):
-            yield [pos_tag(wordpunct_tokenize(sent), lang='rus') for sent in sent_tokenize(paragraph)]
+        yield from tag_stream(self.paras(fileids, categories))
 
 
 class HTMLCorpusReader(CategorizedCorpusReader, CorpusReader):
@@ -120,7 +320,8 @@ class HTMLCorpusReader(CategorizedCorpusReader, CorpusReader):
     дополнительной предварительной обработки.
     """
 
-    def __init__(self, root, fileids=HTML_PATTERN, encoding='utf8', tags=TAGS, **kwargs):
+    def __init__(self, root, fileids=HTML_PATTERN, encoding='utf8', tags=TAGS, cache=None, cache_size=1024,
+                 manifest=None, **kwargs):
         """
         Инициализация класса для чтения HTML-файлов с использованием средств NLTK.
 
@@ -128,15 +329,82 @@ class HTMLCorpusReader(CategorizedCorpusReader, CorpusReader):
         :param fileids: Шаблон по которому извлекаются документы
         :param encoding: Кодировка, в которой считываются файлы
         :param tags: HTML теги использующиеся для извлечения текста
+        :param cache: Путь к кэшу результатов readability на диске или объект DocumentCache
+            (None - кэш только в памяти). Кэш не следует размещать внутри *root*.
+        :param cache_size: Количество документов, результаты которых хранятся в памяти
+        :param manifest: Путь к манифесту корпуса (см. *init_corpus*). Манифест не следует размещать внутри *root*.
         :param kwargs: Дополнительные параметры
         """
         if not any(key.startswith('cat_') for key in kwargs.keys()):
             kwargs['cat_pattern'] = CAT_PATTERN
 
         # TXTCorpusReader.__init__(self, root, fileids, encoding, **kwargs)
-        CategorizedCorpusReader.__init__(self, kwargs)
-        CorpusReader.__init__(self, root, fileids, encoding)
+        self.init_corpus(root, fileids, encoding, manifest, kwargs)
         self.tags = tags
+        self.cache = cache if isinstance(cache, DocumentCache) else DocumentCache(cache, cache_size)
+
+    def init_corpus(self, root, fileids, encoding, manifest=None, kwargs=None):
+        """
+        Инициализирует список файлов и категорий корпуса. Без манифеста каталог корпуса
+        обходится средствами NLTK. С манифестом (*storage.CorpusManifest*) перечитываются
+        только изменившиеся каталоги, а категории берутся из манифеста без сопоставления
+        шаблону, и *fileids(categories)*/*categories(fileids)* становятся обращениями к словарям.
+        """
+        if manifest is None:
+            CategorizedCorpusReader.__init__(self, kwargs)
+            CorpusReader.__init__(self, root, fileids, encoding)
+            return
+
+        cat_pattern = kwargs.get('cat_pattern')
+        if cat_pattern is None:
+            raise ValueError('Манифест корпуса поддерживает только категории по шаблону (cat_pattern)')
+        CategorizedCorpusReader.__init__(self, kwargs)
+        CorpusReader.__init__(self, root, [], encoding)
+
+        corpus_manifest = CorpusManifest(manifest)
+        try:
+            corpus_manifest.refresh(self.root, fileids, cat_pattern)
+            files = corpus_manifest.files()
+        finally:
+            corpus_manifest.close()
+        self._fileids = [fileid for fileid, _ in files]
+        self.index_categories(files)
+
+    def index_categories(self, pairs):
+        """
+        Строит словари категорий по парам (fileid, category), упорядоченным по fileid.
+        """
+        self._fileid_category = {}
+        self._category_fileids = {}
+        for fileid, category in pairs:
+            self._fileid_category[fileid] = category
+            self._category_fileids.setdefault(category, []).append(fileid)
+
+    def fileids(self, categories=None):
+        """
+        Возвращает идентификаторы файлов корпуса или указанных категорий.
+        """
+        index = getattr(self, '_category_fileids', None)
+        if index is None or categories is None:
+            return super().fileids(categories)
+        if isinstance(categories, str):
+            if categories not in index:
+                raise ValueError(f'Категория {categories} не найдена')
+            return list(index[categories])
+        return sorted(set().union(*(index.get(category, ()) for category in categories)))
+
+    def categories(self, fileids=None):
+        """
+        Возвращает категории корпуса или указанных файлов.
+        """
+        index = getattr(self, '_fileid_category', None)
+        if index is None:
+            return super().categories(fileids)
+        if fileids is None:
+            return sorted(self._category_fileids)
+        if isinstance(fileids, str):
+            fileids = [fileids]
+        return sorted({index[fileid] for fileid in fileids})
 
     def resolve(self, fileids=None, categories=None):
         """
@@ -154,36 +422,74 @@ class HTMLCorpusReader(CategorizedCorpusReader, CorpusReader):
     def docs(self, fileids=None, categories=None):
         """
         Генератор, который возвращает весь текст документа закрывая его по завершению чтения.
+        Сжатые документы (.gz, .zst) распаковываются прозрачно.
         """
         fileids = self.resolve(fileids, categories)
 
         for path, encoding in self.abspaths(fileids, include_encoding=True):
-            with open(path, 'r', encoding=encoding) as f:
+            with open_page(path, encoding=encoding) as f:
                 yield f.read()
 
+    def stat(self, fileid):
+        """
+        Возвращает размер и время изменения исходного файла документа.
+        """
+        stat = os.stat(self.abspath(fileid))
+        return stat.st_size, stat.st_mtime
+
+    def content_hash(self, fileid):
+        """
+        Возвращает хэш содержимого исходного файла документа (в том виде, в котором он хранится).
+        """
+        content_hash = hashlib.sha1()
+        with open(self.abspath(fileid), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                content_hash.update(chunk)
+        return content_hash.hexdigest()
+
+    def cached(self, kind, extract, fileids=None, categories=None):
+        """
+        Генератор, возвращающий результат *extract(doc)* для каждого документа.
+        Результаты кэшируются по идентификатору файла и хэшу содержимого: повторный
+        проход по корпусу только считывает документы и не выполняет разбор заново.
+
+        :param str kind: Вид результата, под которым он хранится в кэше
+        :param extract: Функция разбора текста документа; результат должен сериализоваться в JSON
+        """
+        fileids = self.resolve(fileids, categories)
+        if isinstance(fileids, str):
+            fileids = [fileids]
+
+        for fileid, doc in zip(fileids, self.docs(fileids)):
+            content_hash = hashlib.sha1(doc.encode('utf-8')).hexdigest()
+            yield self.cached_value(kind, extract, fileid, doc, content_hash)
+
+    def cached_value(self, kind, extract, fileid, doc, content_hash):
+        """
+        Возвращает результат *extract(doc)* для одного документа из кэша, вычисляя его при отсутствии.
+        """
+        value = self.cache.get(kind, fileid, content_hash)
+        if value is None:
+            value = extract(doc)
+            self.cache.put(kind, fileid, content_hash, value)
+        return value
+
     def html(self, fileids=None, categories=None):
         """
         Возвращает содержимое HTML документов, очищая их с помощью библиотеки readability-lxml.
         """
-        for doc in self.docs(fileids, categories):
-            try:
-                yield Paper(doc).summary()
-            except Unparseable as e:
-                print(f'Не могу распарсить HTML-страницу: {e}')
-                continue
+        for html in self.cached('html', summary, fileids, categories):
+            if html:
+                yield html
 
     def paras(self, fileids=None, categories=None):
         """
         Генератор для выделения абзацев из HTML.
         Использует библиотеку BeautifulSoup.
         """
-        tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'h7', 'p', 'li']
-        fileids = self.resolve(fileids, categories)
-        for html in self.html(fileids, categories):
-            soup = bs4.BeautifulSoup(html, 'lxml')
-            for element in soup.find_all(tags):
-                yield element.text
-            soup.decompose()
+        for paras in self.cached('paras', extract_paras, fileids, categories):
+            for para in paras:
+                yield para
 
     def sents(self, fileids=None, categories=None):
         """
@@ -202,77 +508,174 @@ class HTMLCorpusReader(CategorizedCorpusReader, CorpusReader):
                 yield token
 
     def tokenize(self, fileids=None, categories=None):
-        for paragraph in self.paras(fileids, categories):
-            yield [pos_tag(wordpunct_tokenize(sent), lang='rus') for sent in sent_tokenize(paragraph)]
+        yield from tag_stream(self.paras(fileids, categories))
 
     # TODO: (*дубликаты*)
     # def token_filter(self, tokens):
     #     return filtered_tokens
 
-    def describe(self, fileids=None, categories=None):
+    def stats(self, fileids=None, categories=None):
+        """
+        Генератор статистик отдельных документов (см. *paras_stats*). Статистики кэшируются
+        по хэшу содержимого, как и абзацы, из которых они вычисляются.
+        """
+        fileids = self.resolve(fileids, categories)
+        if isinstance(fileids, str):
+            fileids = [fileids]
+
+        for fileid, doc in zip(fileids, self.docs(fileids)):
+            content_hash = hashlib.sha1(doc.encode('utf-8')).hexdigest()
+
+            def extract(text):
+                return paras_stats(self.cached_value('paras', extract_paras, fileid, text, content_hash))
+
+            yield self.cached_value('stats', extract, fileid, doc, content_hash)
+
+    def describe(self, fileids=None, categories=None, processes=1, chunksize=16):
         """
         Выполняет обход содержимого корпуса и возвращает словарь с различными оценками,
-        описывающим состояние корпуса.
+        описывающим состояние корпуса. Статистики документов вычисляются независимо
+        (в том числе в нескольких процессах) и затем объединяются.
 
         :param (str) fileids: Название отдельно выбранного файла
         :param (str) categories: Категория, из которой извлекаются все документы
+        :param (int) processes: Количество процессов (None - по числу ядер). Чтобы статистики,
+            вычисленные в процессах, сохранялись между запусками, нужен кэш на диске (*cache*).
+        :param (int) chunksize: Количество документов, обрабатываемых процессом за раз
         :return (dict): Словарь с различными оценками,
             описывающим состояние корпуса.
         """
         started = time.time()
 
-        counts = nltk.FreqDist()
-        tokens = nltk.FreqDist()
+        fileids = self.resolve(fileids, categories)
+        if isinstance(fileids, str):
+            fileids = [fileids]
 
-        for para in self.paras(fileids, categories):
-            counts['paras'] += 1
+        if processes == 1:
+            total = describe_chunk(self, fileids)
+        else:
+            chunks = [fileids[start:start + chunksize] for start in range(0, len(fileids), chunksize)]
+            total = empty_stats()
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(processes, initializer=_init_reader_worker, initargs=(self,)) as pool:
+                for stats in pool.imap_unordered(_describe_worker, chunks):
+                    merge_stats(total, stats)
 
-            # for sent in t_para:
-            for sent in sent_tokenize(para):
-                counts['sents'] += 1
-
-                # Удаление символов
-                delete_symbols = ['\n', ',', '.', '!', '?', ':', ';', '_', '#', '(', ')', '\\', '/', '⇡', '×',
-                                  '«', '»', '', '—', '<', '>', '+', '[', ']', '👎', '❌', '🇵🇹', '🇦🇷', '🟢', '🔴',
-                                  '⚪️', '\u200b', '…', '👌', '•\u200e', '"', '\u2009']
-                word_tokens = str(sent)
-                word_tokens = word_tokens.replace('\xa0', ' ')
-                for ds in delete_symbols:
-                    word_tokens = word_tokens.replace(ds, '')
-                word_tokens = word_tokens.split(' ')
-
-                # for word in wordpunct_tokenize(sent):
-                for word in word_tokens:
-                    counts['words'] += 1
-                    tokens[word] += 1
-
-        n_fileids = len(self.resolve(fileids, categories) or self.fileids)
-        n_topics = len(self.categories(self.resolve(fileids, categories)))
+        tokens = total['tokens']
+        n_fileids = len(fileids)
+        n_topics = len(self.categories(fileids))
 
         result = {
             'files': n_fileids,
             'topics': n_topics,
-            'paras': counts['paras'],
-            'sents': counts['sents'],
-            'words': counts['words'],
+            'paras': total['paras'],
+            'sents': total['sents'],
+            'words': total['words'],
             'vocab': len(tokens),
-            'lexdiv': float(counts['words']) / float(len(tokens)),
-            'ppdoc': float(counts['paras']) / float(n_fileids),
-            'sspar': float(counts['sents']) / float(counts['paras']),
+            'lexdiv': float(total['words']) / float(len(tokens)),
+            'ppdoc': float(total['paras']) / float(n_fileids),
+            'sspar': float(total['sents']) / float(total['paras']),
             'secs': time.time() - started
         }
         return result
 
 
+class ArchiveCorpusReader(HTMLCorpusReader):
+    """
+    Объект для чтения корпуса с HTML-документами из архива сегментов, который
+    записывает скрапер (*storage.format: archive*). Идентификаторы файлов и категории
+    берутся из индекса архива, без обхода каталогов.
+    """
+
+    def __init__(self, root, encoding='utf8', tags=TAGS, cache=None, cache_size=1024, **kwargs):
+        """
+        Инициализация класса для чтения архива сегментов.
+
+        :param root: Путь к каталогу архива
+        :param encoding: Кодировка, в которой считываются документы
+        :param tags: HTML теги использующиеся для извлечения текста
+        :param cache: Путь к кэшу результатов readability на диске или объект DocumentCache
+        :param cache_size: Количество документов, результаты которых хранятся в памяти
+        :param kwargs: Дополнительные параметры
+        """
+        self.archive = SegmentArchive(root)
+        records = self.archive.records()
+
+        # Идентификаторы упорядочены по положению записей в сегментах: полный проход читает сегменты подряд
+        kwargs['cat_map'] = {record[0]: [record[1]] for record in records}
+        CategorizedCorpusReader.__init__(self, kwargs)
+        CorpusReader.__init__(self, root, [record[0] for record in records], encoding)
+        self.index_categories((record[0], record[1]) for record in records)
+        self.tags = tags
+        self.cache = cache if isinstance(cache, DocumentCache) else DocumentCache(cache, cache_size)
+
+    def abspath(self, fileid):
+        """
+        Возвращает виртуальный путь документа внутри каталога архива.
+        """
+        return os.path.join(self.root, fileid)
+
+    def docs(self, fileids=None, categories=None):
+        """
+        Генератор, который возвращает весь текст документа из архива.
+        """
+        fileids = self.resolve(fileids, categories)
+        if isinstance(fileids, str):
+            fileids = [fileids]
+
+        for data in self.archive.read(fileids):
+            yield data.decode(self._encoding)
+
+    def stat(self, fileid):
+        """
+        Возвращает размер записи и время её добавления в архив.
+        """
+        length, added, _ = self.archive.state(fileid)
+        return length, added
+
+    def content_hash(self, fileid):
+        """
+        Возвращает хэш содержимого записи из индекса архива.
+        """
+        return self.archive.state(fileid)[2] or hashlib.sha1(next(self.archive.read(fileid))).hexdigest()
+
+    def __getstate__(self):
+        # Соединение с индексом не передаётся в процессы обработки: каждый процесс открывает своё
+        state = self.__dict__.copy()
+        state['archive'] = self.archive.root
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.archive = SegmentArchive(self.archive)
+
+
 class Preprocessor(object):
     """
     Обертывает 'HTMLCorpusReader' и выполняет лексемизацию
     с маркировкой частями речи.
     """
 
-    def __init__(self, corpus, target='./processed_corpus', **kwargs):
+    # Версия конвейера обработки. Её нужно увеличивать при изменении tokenize/process,
+    # чтобы инкрементальная обработка пересчитала ранее полученные результаты.
+    version = '2'
+
+    def __init__(self, corpus, target='./processed_corpus', manifest=None, format='tokens', **kwargs):
+        """
+        :param corpus: Объект чтения исходного корпуса
+        :param str target: Каталог для записи результатов обработки
+        :param str manifest: Путь к манифесту обработки (по умолчанию - manifest.sqlite3 в каталоге *target*)
+        :param str format: Формат результатов: 'tokens' - колоночный формат с общим словарём
+            (vocab.sqlite3 в каталоге *target*), 'pickle' - сериализованные списки
+        """
+        if format not in ('tokens', 'pickle'):
+            raise ValueError(f'Неизвестный формат результатов: {format}')
         self.corpus = corpus
         self.target = target
+        self.manifest = manifest or os.path.join(target, 'manifest.sqlite3')
+        self.format = format
+        self.vocabulary = Vocabulary(os.path.join(target, 'vocab.sqlite3'))
+        self.errors = {}
 
     def fileids(self, fileids=None, categories=None):
         fileids = self.corpus.resolve(fileids, categories)
@@ -290,9 +693,11 @@ class Preprocessor(object):
         # Выделить части пути для реконструирования
         basename = os.path.basename(fileid)
         name, ext = os.path.splitext(basename)
+        if ext in COMPRESSION_EXTENSIONS.values():
+            name, ext = os.path.splitext(name)
 
-        # Сконструировать имя файла с расширением .pickle
-        basename = name + '.pickle'
+        # Сконструировать имя файла с расширением формата результатов (.tokens или .pickle)
+        basename = f'{name}.{self.format}'
 
         # Вернуть путь к файлу относительно корня целевого корпуса
         return os.path.normpath(os.path.join(self.target, parent, basename))
@@ -302,8 +707,8 @@ class Preprocessor(object):
         Обработка и токенизация слов из указанного файла.
         """
         # TODO: переделать для русского языка (корректно)
-        for paragraph in self.corpus.paras(fileids=fileid):
-            yield [pos_tag(wordpunct_tokenize(sent), lang='rus') for sent in sent_tokenize(paragraph)]
+        # Весь документ размечается одним пакетом
+        yield from tag_paras(list(self.corpus.paras(fileids=fileid)))
 
     def process(self, fileid):
         """
@@ -315,9 +720,8 @@ class Preprocessor(object):
         target = self.abspath(fileid)
         parent = os.path.dirname(target)
 
-        # Убедиться в сущестовании каталога
-        if not os.path.exists(parent):
-            os.makedirs(parent)
+        # Убедиться в сущестовании каталога (каталог могут одновременно создавать несколько процессов)
+        os.makedirs(parent, exist_ok=True)
 
         # Убедиться, что parent - это каталог, а не файл
         if not os.path.isdir(parent):
@@ -327,9 +731,12 @@ class Preprocessor(object):
         doc = self.tokenize(fileid)
         document = list(doc)
 
-        # Записать данные в архив на диск
-        with open(target, 'wb') as file:
-            pickle.dump(document, file, pickle.HIGHEST_PROTOCOL)
+        # Записать данные на диск
+        if self.format == 'tokens':
+            write_tokens(target, document, self.vocabulary)
+        else:
+            with open(target, 'wb') as file:
+                pickle.dump(document, file, pickle.HIGHEST_PROTOCOL)
 
         # Удалить документ из памяти
         del document
@@ -337,96 +744,353 @@ class Preprocessor(object):
         # Вернуть путь к целевому файлу
         return target
 
-    def transform(self, fileids=None, categories=None):
+    def source_state(self, fileid):
+        """
+        Возвращает состояние исходного документа (размер, время изменения, хэш содержимого).
+        """
+        size, mtime = self.corpus.stat(fileid)
+        return size, mtime, self.corpus.content_hash(fileid)
+
+    def safe_process(self, fileid):
+        """
+        Обрабатывает один файл, не прерывая общий проход при ошибке.
+
+        :return: Кортеж (fileid, путь к результату или None, описание ошибки или None,
+            состояние исходного документа до обработки или None)
+        """
+        try:
+            state = self.source_state(fileid)
+            return fileid, self.process(fileid), None, state
+        except Exception as e:
+            return fileid, None, f'{type(e).__name__}: {e}', None
+
+    def is_current(self, fileid, entry, manifest):
+        """
+        Проверяет, соответствует ли результат из манифеста текущему исходному документу.
+        Если изменилось только время изменения, а содержимое осталось прежним,
+        манифест обновляется без повторной обработки.
+
+        :param str fileid: Идентификатор исходного документа
+        :param tuple entry: Запись манифеста (target, size, mtime, hash, version)
+        :param ProcessingManifest manifest: Манифест обработки
+        """
+        target, size, mtime, content_hash, version = entry
+        # Результат в другом формате (или в другом каталоге) не считается текущим
+        if version != self.version or target != self.abspath(fileid) or not os.path.exists(target):
+            return False
+        try:
+            current_size, current_mtime = self.corpus.stat(fileid)
+            if (current_size, current_mtime) == (size, mtime):
+                return True
+            if current_size != size or self.corpus.content_hash(fileid) != content_hash:
+                return False
+        except (OSError, KeyError):
+            return False
+        manifest.add(fileid, target, current_size, current_mtime, content_hash, version)
+        return True
+
+    def changed(self, fileids, manifest):
+        """
+        Возвращает документы, которые ещё не обрабатывались или изменились после обработки.
+        """
+        entries = manifest.entries()
+        changed = [fileid for fileid in fileids
+                   if fileid not in entries or not self.is_current(fileid, entries[fileid], manifest)]
+        print(f'Документов без изменений: {len(fileids) - len(changed)}, к обработке: {len(changed)}')
+        return changed
+
+    def prune(self, manifest):
+        """
+        Удаляет результаты обработки документов, которых больше нет в исходном корпусе.
+
+        :return: Список идентификаторов удалённых документов
+        """
+        sources = set(self.corpus.fileids())
+        entries = manifest.entries()
+        orphans = [fileid for fileid in entries if fileid not in sources]
+        for fileid in orphans:
+            target = entries[fileid][0]
+            if os.path.exists(target):
+                os.remove(target)
+        manifest.remove(orphans)
+        print(f'Удалено результатов без исходных документов: {len(orphans)}')
+        return orphans
+
+    def transform(self, fileids=None, categories=None, processes=1, chunksize=16, report_every=100,
+                  incremental=True, prune=False):
+        """
+        Обрабатывает файлы корпуса и возвращает пути к результатам по мере готовности.
+        Ошибка в отдельном документе не прерывает проход: документ пропускается, а ошибка
+        выводится и сохраняется в *self.errors*.
+
+        :param int processes: Количество процессов обработки (None - по числу ядер).
+            При processes=1 файлы обрабатываются в текущем процессе по порядку.
+        :param int chunksize: Количество идентификаторов файлов, передаваемых процессу за раз
+        :param int report_every: Через сколько документов выводить прогресс (0 - не выводить)
+        :param bool incremental: Обрабатывать только новые и изменившиеся документы (по манифесту)
+        :param bool prune: Удалить результаты документов, исходные файлы которых больше не существуют
+        """
         # Создать целевой каталог, если чего ещё нет
         if not os.path.exists(self.target):
             os.makedirs(self.target)
 
         # Получить имена файлов для обработки
-        for fileid in self.fileids(fileids, categories):
-            yield self.process(fileid)
-
-    def save_tokens(self, fileids=None, categories=None):
+        fileids = self.fileids(fileids, categories)
+        if isinstance(fileids, str):
+            fileids = [fileids]
+
+        manifest = ProcessingManifest(self.manifest)
+        try:
+            if prune:
+                self.prune(manifest)
+            if incremental:
+                fileids = self.changed(fileids, manifest)
+
+            self.errors = {}
+            progress = Progress(len(fileids), report_every)
+            if processes == 1:
+                for result in map(self.safe_process, fileids):
+                    yield from self._collect(result, progress, manifest)
+            else:
+                context = multiprocessing.get_context('spawn')
+                with context.Pool(processes, initializer=_init_worker, initargs=(self,)) as pool:
+                    for result in pool.imap_unordered(_process_worker, fileids, chunksize=chunksize):
+                        yield from self._collect(result, progress, manifest)
+            progress.finish()
+        finally:
+            manifest.close()
+
+    def _collect(self, result, progress, manifest):
+        fileid, target, error, state = result
+        if error is not None:
+            self.errors[fileid] = error
+            print(f'Не удалось обработать {fileid}: {error}')
+        progress.update(error is not None)
+        if target is not None:
+            manifest.add(fileid, target, *state, self.version)
+            yield target
+
+    def save_tokens(self, fileids=None, categories=None, path=None, processes=1, max_words=500000, min_count=1):
         """
-        Сохранение простого словаря со словами в файле формата JSON.
+        Строит словарь кириллических слов корпуса с частотами и количеством документов
+        и сохраняет его в двоичном формате (см. *storage.write_vocabulary*). Память
+        ограничена: частичные результаты сбрасываются на диск и затем объединяются.
+
+        :param str path: Путь к файлу словаря (по умолчанию - vocabulary.bin в каталоге *target*)
+        :param int processes: Количество процессов подсчёта (None - по числу ядер). Каждый процесс
+            получает свою часть документов и подсчитывает её одним проходом
+        :param int max_words: Количество различных слов в памяти процесса, после которого
+            частичные результаты сбрасываются на диск (а также один раз в конце подсчёта)
+        :param int min_count: Минимальная частота слова для включения в словарь
+        :return: Путь к файлу словаря
         """
-        tokens = nltk.FreqDist()
-        counts = 0
-        for para in self.corpus.paras(fileids, categories):
-            for sent in sent_tokenize(para):
-                # Удаление символов
-                delete_symbols = ['\n', ',', '.', '!', '?', ':', ';', '_', '#', '(', ')', '\\', '/', '⇡', '×',
-                                  '«', '»', '', '—', '<', '>', '+', '%', '[', ']', '👎', '❌', '🇵🇹', '🇦🇷', '🟢',
-                                  '🔴', '⚪️', '\u200b', '…', '👌', '•\u200e', '"', '\u2009', '£']
-                word_tokens = str(sent)
-                word_tokens = word_tokens.replace('\xa0', ' ')
-                for ds in delete_symbols:
-                    word_tokens = word_tokens.replace(ds, '')
-                word_tokens = word_tokens.split(' ')
-                counts += 1
-                # print(counts)
-                for word in word_tokens:
-                    if iscyrillic(word) and word != '':
-                        tokens[word] += 1
-
-        word_list = {
-            "words": list(tokens.keys())
-        }
+        path = path or os.path.join(self.target, 'vocabulary.bin')
+        fileids = self.fileids(fileids, categories)
+        if isinstance(fileids, str):
+            fileids = [fileids]
+        if not os.path.exists(self.target):
+            os.makedirs(self.target)
 
-        path = f'{self.target}/word_list_ru_050922.json'
+        directory = tempfile.mkdtemp(prefix='vocabulary-', dir=self.target)
+        try:
+            if processes == 1:
+                spills, documents = count_words(self.corpus, fileids, directory, max_words)
+            else:
+                # По одной части документов на процесс (через один, чтобы уравнять категории разного размера)
+                processes = processes or os.cpu_count() or 1
+                tasks = [(fileids[start::processes], directory, max_words) for start in range(processes)]
+                spills, documents = [], 0
+                context = multiprocessing.get_context('spawn')
+                with context.Pool(processes, initializer=_init_reader_worker, initargs=(self.corpus,)) as pool:
+                    for part_spills, part_documents in pool.imap_unordered(_count_words_worker, tasks):
+                        spills.extend(part_spills)
+                        documents += part_documents
+            words = write_vocabulary(path, merge_counts(spills), documents, min_count)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        print(f'Словарь: {words} слов, документов: {documents}')
+        return path
 
-        with open(path, 'w', encoding='utf-8') as output_file:
-            json.dump(word_list, output_file)
 
-        return path
+# -- Parallel processing -----------------------------------------------------------------------------------------------
+class Progress:
+    """
+    Вывод прогресса обработки: количество документов, скорость и число ошибок.
+    """
+
+    def __init__(self, total, report_every=100):
+        self.total = total
+        self.report_every = report_every
+        self.done = 0
+        self.failed = 0
+        self.started = time.time()
+
+    def update(self, failed=False):
+        self.done += 1
+        self.failed += failed
+        if self.report_every and self.done % self.report_every == 0:
+            self.report()
+
+    def report(self):
+        elapsed = time.time() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        percent = self.done / self.total if self.total else 1.0
+        print(f'{self.done}/{self.total} ({percent:.0%}) | {rate:.1f} док/с | ошибок: {self.failed}')
+
+    def finish(self):
+        if self.report_every and self.done % self.report_every != 0:
+            self.report()
+
+
+# Обработчик процесса из пула: создаётся один раз при запуске процесса
+_preprocessor = None
+
+
+def _init_worker(preprocessor):
+    global _preprocessor
+    _preprocessor = preprocessor
+
+
+def _process_worker(fileid):
+    return _preprocessor.safe_process(fileid)
+
+
+# Объект чтения корпуса в процессе из пула
+_reader = None
+
+
+def _init_reader_worker(reader):
+    global _reader
+    _reader = reader
+
+
+def _describe_worker(fileids):
+    return describe_chunk(_reader, fileids)
+
+
+def _count_words_worker(task):
+    return count_words(_reader, *task)
+
+
+class PickledDocument:
+    """
+    Документ в виде сериализованных списков (.pickle) с тем же интерфейсом обхода, что у TokenDocument.
+    """
+
+    def __init__(self, document):
+        self.document = document
+
+    def paras(self):
+        return iter(self.document)
+
+    def sents(self):
+        for para in self.document:
+            yield from para
+
+    def tagged(self):
+        for sent in self.sents():
+            yield from sent
+
+    def words(self):
+        for tagged in self.tagged():
+            yield tagged[0]
 
 
 # TODO: описание функций для извлечения данных
 class PickledCorpusReader(HTMLCorpusReader):
-    def __init__(self, root, fileids=PKL_PATTERN, **kwargs):
+    """
+    Объект для чтения обработанного корпуса: документов в колоночном формате (.tokens)
+    и сериализованных списков прежнего формата (.pickle).
+    """
+
+    def __init__(self, root, fileids=PKL_PATTERN, vocabulary=None, manifest=None, **kwargs):
+        """
+        :param root: Путь к каталогу обработанного корпуса
+        :param fileids: Шаблон по которому извлекаются документы
+        :param vocabulary: Путь к словарю корпуса (по умолчанию - vocab.sqlite3 в каталоге *root*)
+        :param manifest: Путь к манифесту корпуса (см. *HTMLCorpusReader.init_corpus*)
+        :param kwargs: Дополнительные параметры
+        """
         if not any(key.startswith('cat_') for key in kwargs.keys()):
             kwargs['cat_pattern'] = CAT_PATTERN
-        CategorizedCorpusReader.__init__(self, kwargs)
-        CorpusReader.__init__(self, root, fileids)
+        self.init_corpus(root, fileids, 'utf8', manifest, kwargs)
+        self.vocabulary = Vocabulary(vocabulary or os.path.join(self.root, 'vocab.sqlite3'))
 
-    def docs(self, fileids=None, categories=None):
+    def documents(self, fileids=None, categories=None):
+        """
+        Генератор документов корпуса: документы .tokens отображаются в память
+        и закрываются после обхода, документы .pickle загружаются целиком.
+        """
         fileids = self.resolve(fileids, categories)
 
         for path in self.abspaths(fileids):
-            with open(path, 'rb') as file:
-                yield pickle.load(file)
+            if path.endswith('.pickle'):
+                with open(path, 'rb') as file:
+                    yield PickledDocument(pickle.load(file))
+            else:
+                with TokenDocument(path, self.vocabulary) as document:
+                    yield document
+
+    def docs(self, fileids=None, categories=None):
+        for document in self.documents(fileids, categories):
+            yield list(document.paras())
 
     def paras(self, fileids=None, categories=None):
-        for doc in self.docs(fileids, categories):
-            for para in doc:
-                yield para
+        for document in self.documents(fileids, categories):
+            yield from document.paras()
 
     def sents(self, fileids=None, categories=None):
-        for para in self.paras(fileids, categories):
-            for sent in para:
-                yield sent
+        for document in self.documents(fileids, categories):
+            yield from document.sents()
 
     def tagged(self, fileids=None, categories=None):
-        for sent in self.sents(fileids, categories):
-            for tagged_token in sent:
-                yield tagged_token
+        for document in self.documents(fileids, categories):
+            yield from document.tagged()
 
     def words(self, fileids=None, categories=None):
-        for tagged in self.tagged(fileids, categories):
-            yield tagged[0]
+        for document in self.documents(fileids, categories):
+            yield from document.words()
+
+
+# -- Export ------------------------------------------------------------------------------------------------------------
+# Названия источников в таблице по категориям (каталогам) корпуса
+SITE_NAMES = {
+    '3dnews.ru': '3dnews.ru',
+    'kuban.rbc.ru': 'kuban.rbc.ru',
+    'ria.ru': 'ria.ru',
+    'lenta.rupartsnews': 'lenta.ru/parts/news',
+    'sports.ru': 'sports.ru',
+}
+# Служебные слова, которые не попадают в содержание таблицы
+XLSX_FILTER = {'https', '/', 'html', 'meta', 'head', 'xn', 'ria', 'ru', 'internet'}
+XLSX_COLUMNS = ['Содержание', 'Источник', 'Да', '?', 'Нет']
+# Максимальная длина текста в ячейке Excel
+XLSX_CELL_LIMIT = 32767
+
+
+def docx_path(path_to_docx, folder_file_name):
+    """
+    Путь к файлу .docx документа корпуса: <path_to_docx>/<категория>/<имя файла>.docx
+    """
+    folder = folder_file_name.split('/')[0]
+    file = os.path.splitext(os.path.basename(folder_file_name))[0]
+    return f'{path_to_docx}/{folder}/{file}.docx'
 
 
 def create_docx(path_to_docx, text_structure, folder_file_name):
     """
-    Функция для обработки .pickle и с последующим созданием файлов .docx с текстовой информацией
-    :param path_to_docx:
-    :param text_structure:
-    :param folder_file_name:
+    Функция для обработки .pickle и с последующим созданием файлов .docx с текстовой информацией.
+    Файл сначала записывается во временный и затем переименовывается, поэтому прерванная
+    выгрузка не оставляет неполных документов.
+
+    :param path_to_docx: Каталог для файлов .docx
+    :param text_structure: Абзацы документа (списки предложений из пар (слово, тег)), например *reader.paras(fileid)*
+    :param folder_file_name: Идентификатор документа в корпусе
     :return:
     """
-    name_list = folder_file_name.split('/')
-    folder = name_list[0]
-    file = name_list[1].replace('.pickle', '')
+    target = docx_path(path_to_docx, folder_file_name)
+    folder = os.path.dirname(target)
     document = Document()
     for ts in text_structure:
         if ts is None:
@@ -434,47 +1098,225 @@ def create_docx(path_to_docx, text_structure, folder_file_name):
         else:
             for para in ts:
                 if para:
-                    line = ''
-                    for word in para:
-                        line += str(f' {word[0]}')
-                    document.add_paragraph(line)
-    if not os.path.exists(f'{path_to_docx}/{folder}'):
-        os.makedirs(f'{path_to_docx}/{folder}')
-
-    if not os.path.isdir(f'{path_to_docx}/{folder}'):
+                    document.add_paragraph(''.join(f' {word[0]}' for word in para))
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    if not os.path.isdir(folder):
         raise ValueError('Пожалуйста, убедитесь что указан каталог, а не файл')
 
-    document.save(f'{path_to_docx}/{folder}/{file}.docx')
+    document.save(f'{target}.part')
+    os.replace(f'{target}.part', target)
     return 0
 
 
+def document_text(document, limit=XLSX_CELL_LIMIT):
+    """
+    Текст документа для ячейки таблицы: абзац на строку, слова через пробел. Служебные слова
+    (*XLSX_FILTER*) пропускаются, обход прекращается по достижении *limit* символов.
+    """
+    lines = []
+    length = 0
+    for para in document.paras():
+        line = ' '.join(word for sent in para for word, _ in sent if word.lower() not in XLSX_FILTER)
+        if line:
+            lines.append(line)
+            length += len(line) + 1
+            if length >= limit:
+                break
+    return '\n'.join(lines)[:limit]
+
+
+def part_digest(fileids):
+    """
+    Хэш списка документов части таблицы.
+    """
+    return hashlib.sha1('\n'.join(fileids).encode('utf-8')).hexdigest()
+
+
+class Exporter(object):
+    """
+    Выгрузка обработанного корпуса для аналитиков: документы .docx и таблица с классами .xlsx.
+    Документы читаются из *PickledCorpusReader* по одному, поэтому память не зависит от
+    размера корпуса, а повторный запуск пропускает уже готовые результаты.
+    """
+
+    def __init__(self, corpus, target='./docx_result'):
+        """
+        :param PickledCorpusReader corpus: Обработанный корпус
+        :param str target: Каталог для результатов выгрузки
+        """
+        self.corpus = corpus
+        self.target = target
+        self.errors = {}
+
+    def fileids(self, fileids=None, categories=None):
+        fileids = self.corpus.resolve(fileids, categories)
+        if isinstance(fileids, str):
+            fileids = [fileids]
+        return fileids if fileids is not None else self.corpus.fileids()
+
+    def is_current(self, fileid):
+        """
+        Проверяет, что файл .docx документа уже создан и не старше обработанного документа.
+        """
+        target = docx_path(self.target, fileid)
+        try:
+            return os.path.getmtime(target) >= os.path.getmtime(self.corpus.abspath(fileid))
+        except OSError:
+            return False
+
+    def export_docx(self, fileid):
+        """
+        Создаёт файл .docx одного документа, читая абзацы потоком.
+        """
+        create_docx(self.target, self.corpus.paras(fileid), fileid)
+        return docx_path(self.target, fileid)
+
+    def safe_export(self, fileid):
+        """
+        Выгружает один документ, не прерывая общий проход при ошибке.
+
+        :return: Кортеж (fileid, путь к результату или None, описание ошибки или None)
+        """
+        try:
+            return fileid, self.export_docx(fileid), None
+        except Exception as e:
+            return fileid, None, f'{type(e).__name__}: {e}'
+
+    def docx(self, fileids=None, categories=None, processes=1, chunksize=16, report_every=100, resume=True):
+        """
+        Создаёт файлы .docx документов корпуса и возвращает пути к ним по мере готовности.
+
+        :param int processes: Количество процессов (None - по числу ядер). При processes=1
+            документы выгружаются в текущем процессе по порядку.
+        :param int chunksize: Количество идентификаторов файлов, передаваемых процессу за раз
+        :param int report_every: Через сколько документов выводить прогресс (0 - не выводить)
+        :param bool resume: Пропускать документы, файлы .docx которых уже созданы
+        """
+        fileids = self.fileids(fileids, categories)
+        if resume:
+            pending = [fileid for fileid in fileids if not self.is_current(fileid)]
+            print(f'Документов уже выгружено: {len(fileids) - len(pending)}, к выгрузке: {len(pending)}')
+            fileids = pending
+
+        self.errors = {}
+        progress = Progress(len(fileids), report_every)
+        if processes == 1:
+            results = map(self.safe_export, fileids)
+            yield from self._collect(results, progress)
+        else:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(processes, initializer=_init_export_worker, initargs=(self,)) as pool:
+                results = pool.imap_unordered(_export_worker, fileids, chunksize=chunksize)
+                yield from self._collect(results, progress)
+        progress.finish()
+
+    def _collect(self, results, progress):
+        for fileid, target, error in results:
+            if error is not None:
+                self.errors[fileid] = error
+                print(f'Не удалось выгрузить {fileid}: {error}')
+            progress.update(error is not None)
+            if target is not None:
+                yield target
+
+    def source(self, fileid):
+        categories = self.corpus.categories(fileid)
+        category = categories[0] if categories else fileid.split('/')[0]
+        return SITE_NAMES.get(category, category)
+
+    def xlsx(self, fileids=None, categories=None, name='resulted_table', rows_per_file=None, report_every=1000,
+             resume=True):
+        """
+        Создаёт таблицу с классами (*XLSX_COLUMNS*): строка на документ с его содержанием
+        и источником. Таблица записывается потоково (режим write-only openpyxl), в памяти
+        находится только текущий документ.
+
+        :param str name: Имя файла таблицы без расширения
+        :param int rows_per_file: Количество документов в одном файле. Если задано, таблица делится
+            на части <name>_0001.xlsx, <name>_0002.xlsx, ..., и прерванная выгрузка продолжается
+            с первой несозданной части. Без деления таблица (<name>.xlsx) всегда создаётся заново.
+        :param int report_every: Через сколько документов выводить прогресс (0 - не выводить)
+        :param bool resume: Пропускать части таблицы, которые уже созданы из тех же документов
+            и не старше них
+        :return: Список путей к файлам таблицы
+        """
+        if not os.path.exists(self.target):
+            os.makedirs(self.target)
+        if not os.path.isdir(self.target):
+            raise ValueError('Пожалуйста, убедитесь что указан каталог, а не файл')
+
+        fileids = self.fileids(fileids, categories)
+        size = rows_per_file or max(len(fileids), 1)
+        parts = [fileids[i:i + size] for i in range(0, len(fileids), size)] or [[]]
+
+        paths = []
+        progress = Progress(len(fileids), report_every)
+        for number, part in enumerate(parts, 1):
+            path = f'{self.target}/{name}.xlsx' if rows_per_file is None else f'{self.target}/{name}_{number:04}.xlsx'
+            paths.append(path)
+            if resume and rows_per_file is not None and self.is_current_part(path, part):
+                progress.done += len(part)
+                continue
+            self.write_xlsx(path, part, progress)
+        progress.finish()
+
+        # Удалить части, оставшиеся от выгрузки большего числа документов
+        number = len(parts) + 1
+        while rows_per_file is not None and os.path.exists(f'{self.target}/{name}_{number:04}.xlsx'):
+            os.remove(f'{self.target}/{name}_{number:04}.xlsx')
+            number += 1
+        return paths
+
+    def is_current_part(self, path, fileids):
+        """
+        Проверяет, что часть таблицы создана из тех же документов (по хэшу списка документов
+        в свойствах книги) и не старше входящих в неё обработанных документов.
+        """
+        try:
+            with zipfile.ZipFile(path) as archive:
+                if part_digest(fileids) not in archive.read('docProps/core.xml').decode('utf-8'):
+                    return False
+            mtime = os.path.getmtime(path)
+            return all(os.path.getmtime(self.corpus.abspath(fileid)) <= mtime for fileid in fileids)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return False
+
+    def write_xlsx(self, path, fileids, progress):
+        workbook = Workbook(write_only=True)
+        workbook.properties.identifier = part_digest(fileids)
+        sheet = workbook.create_sheet()
+        sheet.append(XLSX_COLUMNS)
+        for fileid, document in zip(fileids, self.corpus.documents(fileids)):
+            sheet.append([document_text(document), self.source(fileid), None, None, None])
+            progress.update()
+        workbook.save(f'{path}.part')
+        os.replace(f'{path}.part', path)
+
+
+# Выгрузка в процессе из пула
+_exporter = None
+
+
+def _init_export_worker(exporter):
+    global _exporter
+    _exporter = exporter
+
+
+def _export_worker(fileid):
+    return _exporter.safe_export(fileid)
+
+
 def resulted_xlsx(path_to_xlsx, fileids, pickled_data):
     """
     Функция для обработки .pickle и с последующим созданием таблицы с классами в формате .xlsx
-    :param path_to_xlsx:
-    :param fileids:
-    :param pickled_data:
-    """
-    resulted_list = []
-    site_dict = {
-        '3dnews.ru': '3dnews.ru',
-        'kuban.rbc.ru': 'kuban.rbc.ru',
-        'ria.ru': 'ria.ru',
-        'lenta.rupartsnews': 'lenta.ru/parts/news',
-        'sports.ru': 'sports.ru',
-    }
-    filter_list = ['https', '/', 'html', 'meta', 'head', 'xn', 'ria', 'ru', 'internet']
-
-    df = pd.DataFrame(resulted_list, columns=['Содержание', 'Источник', 'Да', '?', 'Нет'])
-    df.to_excel(f'{path_to_xlsx}/resulted_table.xlsx', index=False)
-
-    # if not os.path.exists(f'{path_to_docx}/{folder}'):
-    #     os.makedirs(f'{path_to_docx}/{folder}')
-    #
-    # if not os.path.isdir(f'{path_to_docx}/{folder}'):
-    #     raise ValueError('Пожалуйста, убедитесь что указан каталог, а не файл')
-    #
-    # document.save(f'{path_to_docx}/{folder}/{file}.docx')
+    (см. *Exporter.xlsx*)
+    :param path_to_xlsx: Каталог для таблицы
+    :param fileids: Идентификаторы документов
+    :param pickled_data: Обработанный корпус (PickledCorpusReader)
+    """
+    Exporter(pickled_data, path_to_xlsx).xlsx(fileids)
     return 0
 
 
@@ -504,17 +1346,13 @@ if __name__ == "__main__":
     # fileid = f'./3dnews.ru/3dnews.ru1059046obzor-huawei-p50-propage-1.html_1744_09032022.pickle'
     pick = PickledCorpusReader('./processed_corpus', fileids=PKL_PATTERN, cat_pattern=CAT_PATTERN, tags=TAGS)
     fileids = pick.resolve()
-    # path_to_docx = './docx_result'
+    exporter = Exporter(pick, './docx_result')
     # print('--------------------- PICKLE to DOCX ---------------------')
-    # for i, fileid in enumerate(fileids):
-    #     print(f'{i:6}: {fileid}')
-    #     text_structure = next(pick.docs(fileid))
-    #     create_docx(path_to_docx=path_to_docx, text_structure=text_structure, folder_file_name=fileid)
-    # pass
+    # for path in exporter.docx(fileids, processes=None):
+    #     pass
 
     print('--------------------- PICKLE to XLSX ---------------------')
-    path_to_xlsx = './docx_result'
-    resulted_xlsx(path_to_xlsx=path_to_xlsx, fileids=fileids, pickled_data=pick)
+    exporter.xlsx(fileids)
     pass
 
     # Сохранение словаря с уникальными словами
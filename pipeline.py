@@ -0,0 +1,202 @@
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import PIPELINE_DOCUMENTS, PIPELINE_LATENCY, PIPELINE_QUEUE_DEPTH
+from parser import ArchiveCorpusReader, HTMLCorpusReader, Preprocessor
+from storage import ProcessingManifest
+
+
+# -- Streaming pipeline ------------------------------------------------------------------------------------------------
+class StreamingPipeline:
+    """
+    Потоковая предварительная обработка скачанных статей. Скрапер передаёт каждую
+    сохранённую статью в ограниченную очередь, а обработчики отправляют её в пул
+    процессов (readability, выделение абзацев, лексемизация и разметка частями речи).
+    Когда очередь заполнена, загрузка ждёт свободного места, и скрапер замедляется
+    до скорости обработки.
+
+    Результаты и манифест обработки совпадают с пакетным *Preprocessor.transform*,
+    поэтому последующий пакетный запуск пропускает уже обработанные статьи.
+
+    Статья, обработка которой завершилась ошибкой, повторно отправляется в пул до *retries* раз
+    (тем же обработчиком очереди, с паузой *retry_delay*). Если все попытки неудачны, статья
+    не записывается в манифест, сохраняется в *self.errors* и будет обработана следующим
+    пакетным запуском *Preprocessor.transform* (incremental=True). Так же обрабатывается статья,
+    результат которой не удалось записать в манифест (например, манифест заблокирован другим процессом).
+
+    Манифест читается и записывается в пуле потоков цикла событий: проверка статьи
+    читает исходный файл, а запись может ожидать блокировку базы данных.
+    """
+
+    def __init__(self, scraper, target='./processed_corpus', workers=None, queue_size=64, cache=None, retries=2,
+                 retry_delay=1.0):
+        """
+        :param Scraper scraper: Скрапер, статьи которого обрабатываются
+        :param str target: Каталог для записи результатов обработки
+        :param int workers: Количество процессов обработки (по умолчанию - число ядер)
+        :param int queue_size: Количество статей, ожидающих обработки, после которого загрузка приостанавливается
+        :param str cache: Путь к кэшу результатов readability на диске (см. *HTMLCorpusReader*)
+        :param int retries: Количество повторных попыток обработки статьи после ошибки
+        :param float retry_delay: Пауза перед повторной попыткой в секундах (удваивается с каждой попыткой)
+        """
+        self.scraper = scraper
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.errors = {}
+        self.archive = scraper.storage_config.get('format', 'files') == 'archive'
+        if self.archive:
+            corpus = ArchiveCorpusReader(f'{scraper.base_path}/archive', cache=cache)
+        else:
+            if not os.path.exists(scraper.base_path):
+                os.makedirs(scraper.base_path)
+            # Список файлов не нужен: статьи передаются по идентификаторам, каталог не обходится
+            corpus = HTMLCorpusReader(scraper.base_path, fileids=[], cache=cache)
+        self.preprocessor = Preprocessor(corpus, target=target)
+        self.queue = None
+        self.executor = None
+        self.manifest = None
+        self.consumers = []
+        scraper.pipeline = self
+
+    async def start(self):
+        """
+        Запускает пул процессов и обработчики очереди.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.manifest = ProcessingManifest(self.preprocessor.manifest)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(self.preprocessor,))
+        self.consumers = [asyncio.create_task(self.consume()) for _ in range(self.workers)]
+
+    async def submit(self, path):
+        """
+        Ставит сохранённую статью в очередь обработки. Если очередь заполнена,
+        ожидает, пока обработчики не освободят место.
+
+        :param str path: Путь к файлу статьи (для архива сегментов - идентификатор записи)
+        """
+        fileid = path if self.archive else os.path.relpath(path, self.scraper.base_path)
+        await self.queue.put((fileid, time.monotonic()))
+        PIPELINE_QUEUE_DEPTH.set(self.queue.qsize())
+
+    async def consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fileid, queued = await self.queue.get()
+            try:
+                await self.process(loop, fileid, queued)
+            except Exception as exc:
+                PIPELINE_DOCUMENTS.labels(result='error').inc()
+                print(f'Pipeline: {fileid} | Error: {exc!r}')
+            finally:
+                self.queue.task_done()
+                PIPELINE_QUEUE_DEPTH.set(self.queue.qsize())
+
+    def is_processed(self, fileid):
+        """
+        Проверяет по манифесту, что статья уже обработана с тем же содержимым.
+        """
+        entry = self.manifest.get(fileid)
+        return entry is not None and self.preprocessor.is_current(fileid, entry, self.manifest)
+
+    async def process(self, loop, fileid, queued):
+        """
+        Обрабатывает статью в пуле процессов и записывает результат в манифест.
+        Статьи, уже обработанные с тем же содержимым (например, дубликаты), пропускаются.
+        После ошибки обработка повторяется до *self.retries* раз.
+        """
+        if await loop.run_in_executor(None, self.is_processed, fileid):
+            PIPELINE_DOCUMENTS.labels(result='skipped').inc()
+            return
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                PIPELINE_DOCUMENTS.labels(result='retried').inc()
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            fileid, target, error, state = await loop.run_in_executor(self.executor, _process_worker, fileid)
+            if error is None:
+                break
+            print(f'Pipeline: {fileid} | Attempt {attempt + 1}/{self.retries + 1} | Error: {error}')
+        else:
+            # Статья не попадает в манифест и будет обработана следующим пакетным запуском
+            self.errors[fileid] = error
+            PIPELINE_DOCUMENTS.labels(result='error').inc()
+            return
+        try:
+            await loop.run_in_executor(None, self.manifest.add, fileid, target, *state, self.preprocessor.version)
+        except sqlite3.Error as exc:
+            # Результат записан, но не отмечен в манифесте: статья будет обработана следующим пакетным запуском
+            self.errors[fileid] = f'{type(exc).__name__}: {exc}'
+            PIPELINE_DOCUMENTS.labels(result='error').inc()
+            print(f'Pipeline: {fileid} | Manifest error: {exc!r}')
+            return
+        self.errors.pop(fileid, None)
+        PIPELINE_DOCUMENTS.labels(result='processed').inc()
+        PIPELINE_LATENCY.observe(time.monotonic() - queued)
+        print(f'Pipeline: {fileid} | Processed: {target}')
+
+    async def stop(self):
+        """
+        Дожидается обработки всех статей из очереди и останавливает пул процессов.
+        """
+        if self.queue is not None:
+            await self.queue.join()
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.consumers = []
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+
+
+async def run_pipeline(scraper, end_time, shards=1):
+    """
+    Запускает обновление сайтов с потоковой обработкой скачанных статей.
+    Параметры берутся из раздела *pipeline* конфигурации скрапера: target, workers, queue_size, cache,
+    retries, retry_delay. Параметр *workers* задаёт количество процессов обработки для каждого процесса
+    скрапера; по умолчанию ядра делятся поровну между процессами скрапера.
+
+    :param Scraper scraper: Скрапер
+    :param datetime end_time: Время окончания обновлений.
+    :param int shards: Количество процессов скрапера, одновременно запускающих обработку (см. *run_sharded*)
+    """
+    pipeline_config = scraper.scraper_config.get('pipeline', None) or {}
+    workers = pipeline_config.get('workers', None) or max(1, (os.cpu_count() or 1) // shards)
+    pipeline = StreamingPipeline(scraper,
+                                 target=pipeline_config.get('target', './processed_corpus'),
+                                 workers=workers,
+                                 queue_size=pipeline_config.get('queue_size', 64),
+                                 cache=pipeline_config.get('cache', None),
+                                 retries=pipeline_config.get('retries', 2),
+                                 retry_delay=pipeline_config.get('retry_delay', 1.0))
+    await pipeline.start()
+    try:
+        await scraper.start_page_refresh(end_time=end_time)
+    finally:
+        await pipeline.stop()
+
+
+# Обработчик процесса из пула: создаётся один раз при запуске процесса
+_preprocessor = None
+
+
+def _init_worker(preprocessor):
+    global _preprocessor
+    _preprocessor = preprocessor
+
+
+def _process_worker(fileid):
+    return _preprocessor.safe_process(fileid)
@@ -1,24 +1,462 @@
 import asyncio
-import json
+import codecs
+import hashlib
+import heapq
+import io
+import itertools
+import multiprocessing
 import random
 import re
+import time
+import zlib
 import aiohttp
 import aiofiles
 import aiofiles.os
+import lxml.html
 import yaml
 import os
 
-from bs4 import BeautifulSoup
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from lxml import etree
+from urllib.parse import urlparse
+
+from metrics import (DOWNLOADED_BYTES, LAST_NEW_LINKS, NEW_LINKS, NEXT_REFRESH, QUEUE_DEPTH, REFRESH_INTERVAL,
+                     REFRESHES, REQUEST_LATENCY, RESPONSES, SCHEDULED_SITES, STORAGE_LATENCY)
+from storage import PageIndex, SegmentArchive, UrlIndex, page_compressor, page_extension, read_page
+
+
+class PageTooLarge(Exception):
+    """
+    Размер скачиваемой страницы превышает допустимый.
+    """
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+class RequestTimer:
+    """
+    Время, затраченное на сжатие и запись страницы во время чтения ответа.
+    """
+
+    def __init__(self):
+        self.storage = 0.0
+
+    @contextmanager
+    def storing(self):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.storage += time.monotonic() - started
+
+
+@contextmanager
+def track_request(url):
+    """
+    Учитывает время загрузки страницы и ошибки соединения в метриках хоста. Страница пишется
+    на диск по мере чтения ответа, поэтому время сжатия и записи (*RequestTimer.storing*)
+    вычитается из времени загрузки и учитывается отдельно.
+    """
+    host = urlparse(url).netloc
+    timer = RequestTimer()
+    started = time.monotonic()
+    try:
+        yield timer
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        RESPONSES.labels(host=host, status='error').inc()
+        raise
+    finally:
+        REQUEST_LATENCY.labels(host=host).observe(max(0.0, time.monotonic() - started - timer.storage))
+        if timer.storage:
+            STORAGE_LATENCY.labels(host=host).observe(timer.storage)
+
+
+# -- Link extraction ---------------------------------------------------------------------------------------------------
+class LinkExtractor:
+    """
+    Извлекает ссылки на статьи с главной страницы сайта. Параметры конфигурации
+    (tag, tag_class, regular, add_page_name, https_line, delete_part_of_url)
+    один раз собираются в XPath-выражение и скомпилированное регулярное выражение.
+    """
+
+    def __init__(self, site_config):
+        """
+        :param dict site_config: Конфигурация сайта
+        """
+        url = site_config.get('url', None)
+        tag = site_config.get('tag', 'a')
+        regular = site_config.get('regular', None)
+        tag_class = site_config.get('tag_class', None)
+        delete_part_of_url = site_config.get('delete_part_of_url', None)
+
+        self.enabled = regular is not None or tag_class is not None
+        self.regular = re.compile(regular) if regular is not None else None
+
+        # Класс из нескольких имён сравнивается со значением атрибута целиком,
+        # одно имя класса ищется среди классов элемента (как в BeautifulSoup.find_all)
+        if tag_class is None:
+            self.xpath = etree.XPath(f'//{tag}/@href')
+        elif ' ' in tag_class.strip():
+            self.xpath = etree.XPath(f'//{tag}[normalize-space(@class) = $tag_class]/@href')
+        else:
+            self.xpath = etree.XPath(f'//{tag}[contains(concat(" ", normalize-space(@class), " "), '
+                                     f'concat(" ", $tag_class, " "))]/@href')
+        self.tag_class = ' '.join(tag_class.split()) if tag_class is not None else None
+
+        # Удаление "лишней" части ссылки (случай с [lenta.ru: /parts/news/])
+        if delete_part_of_url:
+            url = url.replace(delete_part_of_url, '')
+
+        # Добавление исходной ссылки к отфильтрованным, при необходимости.
+        # Например, https://lenta.ru/parts/news и /2020/10/03/something.
+        # Необходимо для [lenta.ru/parts/news]
+        self.prefix = ''
+        if site_config.get('add_page_name', False) and site_config.get('https_line', True):
+            self.prefix = url
+
+        self.parser = lxml.html.HTMLParser(encoding='utf-8')
+
+    def extract(self, page):
+        """
+        Возвращает список ссылок, найденных на странице.
+
+        :param bytes page: Содержимое страницы в UTF-8
+        """
+        if not self.enabled or not page:
+            return []
+        try:
+            document = lxml.html.document_fromstring(page, parser=self.parser)
+        except etree.ParserError:
+            return []
+
+        if self.tag_class is not None:
+            href_list = self.xpath(document, tag_class=self.tag_class)
+        else:
+            href_list = self.xpath(document)
+
+        filtered_href_list = []
+        if self.regular is not None:
+            for hl in href_list:
+                temp = self.regular.findall(hl)
+                if temp:
+                    filtered_href_list.append(f'{self.prefix}{temp[0]}')
+        else:
+            filtered_href_list = [f'{self.prefix}{hl}' for hl in href_list]
+        return filtered_href_list
+
+
+class FeedExtractor:
+    """
+    Извлекает ссылки на статьи из ленты новостей (RSS, Atom) или карты сайта (sitemap).
+    Документ разбирается потоково, элементы освобождаются сразу после обработки.
+    Ссылки с датой публикации/изменения старше *max_age* пропускаются; повторно найденные
+    ссылки отбрасывает индекс ссылок сайта, поэтому по дате они не фильтруются (записи
+    с одинаковой датой и опубликованные с опозданием не теряются).
+    """
+    ITEM_TAGS = {'item', 'entry', 'url'}
+    DATE_TAGS = ('lastmod', 'publication_date', 'pubDate', 'updated', 'published', 'date')
+
+    def __init__(self, feed_config):
+        """
+        :param dict feed_config: Раздел *feed* конфигурации сайта (url, regular, max_age)
+        """
+        regular = feed_config.get('regular', None)
+        self.regular = re.compile(regular) if regular is not None else None
+        max_age = feed_config.get('max_age', None)
+        self.max_age = to_seconds(max_age) if max_age is not None else None
+
+    def extract(self, page):
+        """
+        Возвращает список ссылок из ленты, не старше *max_age*.
+
+        :param bytes page: Содержимое ленты
+        """
+        if not page:
+            return []
+        oldest = None
+        if self.max_age is not None:
+            oldest = datetime.now(timezone.utc) - timedelta(seconds=self.max_age)
+
+        links = []
+        for link, date in self.items(page):
+            if self.regular is not None and not self.regular.search(link):
+                continue
+            if date is not None and oldest is not None and date < oldest:
+                continue
+            links.append(link)
+        return links
+
+    def has_items(self, page):
+        """
+        Проверяет, что в документе есть хотя бы одна запись со ссылкой (разбор до первой записи).
+        Ответ, который не является лентой, разбирается в режиме восстановления без записей.
+        """
+        return bool(page) and next(self.items(page), None) is not None
+
+    def items(self, page):
+        """
+        Генератор пар (ссылка, дата) из записей ленты.
+        """
+        link = None
+        date = None
+        try:
+            for event, element in etree.iterparse(io.BytesIO(page), events=('start', 'end'), recover=True,
+                                                  resolve_entities=False, no_network=True):
+                if not isinstance(element.tag, str):
+                    continue
+                tag = etree.QName(element).localname
+                if event == 'start':
+                    if tag in self.ITEM_TAGS:
+                        link = None
+                        date = None
+                elif tag in ('link', 'loc') and link is None:
+                    # RSS и sitemap: ссылка в тексте элемента, Atom: в атрибуте href
+                    if element.get('rel', 'alternate') == 'alternate':
+                        link = (element.get('href') or element.text or '').strip() or None
+                elif tag in self.DATE_TAGS and date is None:
+                    date = _parse_date(element.text)
+                elif tag in self.ITEM_TAGS:
+                    if link is not None:
+                        yield link, date
+                    # Освобождаем память, занятую разобранными записями
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+        except etree.XMLSyntaxError as exc:
+            print(f'Feed parse error: {exc}')
+
+
+def _parse_date(value):
+    """
+    Разбирает дату в формате RFC 822 (RSS) или ISO 8601 (Atom, sitemap). Возвращает дату в UTC.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc)
+
+
+# -- Politeness --------------------------------------------------------------------------------------------------------
+class TokenBucket:
+    """
+    Ограничитель частоты запросов по алгоритму «ведро с токенами».
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param float rate: Количество запросов в секунду
+        :param int capacity: Максимальное количество запросов, которые можно выполнить подряд
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Ожидает появления свободного токена и забирает его.
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostPolicy:
+    """
+    Политика вежливости для отдельного хоста: ограничение количества одновременных
+    запросов и их частоты. Настраивается в разделе *politeness* конфигурации сайта.
+    """
+
+    def __init__(self, concurrency=2, rate=0.5, burst=1):
+        """
+        :param int concurrency: Максимальное количество одновременных запросов к хосту
+        :param float rate: Количество запросов в секунду
+        :param int burst: Количество запросов, которые можно выполнить подряд без ожидания
+        """
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate=rate, capacity=burst)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+
+def to_seconds(value):
+    """
+    Переводит интервал из конфигурации ({hours, minutes, seconds} или число секунд) в секунды.
+    """
+    if not isinstance(value, dict):
+        return int(value)
+    return int(value.get('hours', 0)) * 3600 + \
+        int(value.get('minutes', 0)) * 60 + \
+        int(value.get('seconds', 0))
+
+
+# -- Scheduler ---------------------------------------------------------------------------------------------------------
+class RefreshScheduler:
+    """
+    Общий планировщик обновлений главных страниц сайтов. Сайты хранятся в куче,
+    упорядоченной по времени следующего обновления; обновления выполняются
+    ограниченным набором обработчиков, а время обновления смещается случайным
+    образом, чтобы сайты не обновлялись одновременно.
+    """
+
+    def __init__(self, scraper, end_time, workers=8, jitter=0.1):
+        """
+        :param Scraper scraper: Скрапер, выполняющий обновление сайта
+        :param datetime end_time: Время окончания обновлений
+        :param int workers: Максимальное количество одновременно обновляемых сайтов
+        :param float jitter: Доля интервала обновления, на которую случайно смещается время обновления
+        """
+        self.scraper = scraper
+        self.end_time = end_time
+        self.workers = workers
+        self.jitter = jitter
+        self.heap = []
+        self.sites = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.queue = None
+        SCHEDULED_SITES.set_function(lambda: len(self.sites))
+        QUEUE_DEPTH.set_function(lambda: self.queue.qsize() if self.queue is not None else 0)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def add_site(self, site_config, delay=None):
+        """
+        Добавляет сайт в расписание (или заменяет конфигурацию уже добавленного сайта).
+
+        :param dict site_config: Конфигурация сайта
+        :param float delay: Задержка до первого обновления в секундах. По умолчанию
+            выбирается случайно в пределах доли *jitter* от интервала обновления.
+        """
+        name = site_config['folder']
+        generation = next(self.counter)
+        self.sites[name] = (site_config, generation)
+        if delay is None:
+            delay = random.uniform(0, self.jitter * self.scraper.refresh_interval(site_config))
+        self.schedule(name, generation, delay)
+
+    def remove_site(self, name):
+        """
+        Удаляет сайт из расписания. Уже запущенное обновление сайта завершается.
+
+        :param str name: Название сайта (*folder* в конфигурации)
+        """
+        self.sites.pop(name, None)
+        NEXT_REFRESH.labels(site=name).remove()
+        REFRESH_INTERVAL.labels(site=name).remove()
+        self.wakeup.set()
+
+    def schedule(self, name, generation, delay):
+        due = time.monotonic() + delay
+        heapq.heappush(self.heap, (due, generation, name))
+        NEXT_REFRESH.labels(site=name).set_function(lambda: max(0.0, due - time.monotonic()))
+        self.wakeup.set()
+
+    def next_delay(self):
+        """
+        Возвращает время до ближайшего обновления в секундах (None, если расписание пусто).
+        """
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - time.monotonic())
+
+    async def run(self):
+        """
+        Выполняет обновления по расписанию до наступления *end_time*.
+        """
+        self.queue = asyncio.Queue(maxsize=self.workers)
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        try:
+            while datetime.now() < self.end_time and self.sites:
+                time_left = (self.end_time - datetime.now()).total_seconds()
+                delay = self.next_delay()
+                if delay is None or delay > 0:
+                    self.wakeup.clear()
+                    timeout = time_left if delay is None else min(delay, time_left)
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                _, generation, name = heapq.heappop(self.heap)
+                if self.sites.get(name, (None, None))[1] != generation:
+                    # Сайт удалён или перенастроен после постановки в расписание
+                    continue
+                # Очередь ограничена количеством обработчиков: если все заняты, ждём освобождения
+                await self.queue.put((name, generation))
+
+            # Дожидаемся завершения уже запущенных обновлений
+            await self.queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def worker(self):
+        while True:
+            name, generation = await self.queue.get()
+            try:
+                site_config = self.sites[name][0] if name in self.sites else None
+                if site_config is None:
+                    continue
+                update_again = await self.scraper.page_update(site_config=site_config,
+                                                              end_time_for_updates=self.end_time)
+                if not update_again:
+                    print(f'Page: {site_config["url"]} | Time: {datetime.now()} | {update_again}')
+                elif self.sites.get(name, (None, None))[1] == generation:
+                    interval = self.scraper.refresh_interval(site_config)
+                    REFRESH_INTERVAL.labels(site=name).set(interval)
+                    self.schedule(name, generation, interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+            except Exception as exc:
+                print(f'Page: {name} | Error: {exc!r}')
+                if self.sites.get(name, (None, None))[1] == generation:
+                    self.schedule(name, generation, self.scraper.refresh_interval(self.sites[name][0]))
+            finally:
+                self.queue.task_done()
 
 
 # -- Scraper class -----------------------------------------------------------------------------------------------------
 class Scraper:
-    def __init__(self, config='./configs/scraper_config_base.yaml'):
+    def __init__(self, config='./configs/scraper_config_base.yaml', site_list=None, shard=None):
         """
         Инициализация класса Scraper. При инициализации необходимо указать конфигурацию для запуска.
 
         :param str config: Путь к конфигурационному файлу для скрапера.
+        :param list site_list: Список сайтов для обновления (по умолчанию - *site_list* из конфигурации).
+        :param int shard: Номер процесса при многопроцессном запуске (см. *run_sharded*).
         """
         scraper_config = None
         with open(config, 'r') as stream:
@@ -29,255 +467,749 @@ class Scraper:
         self.scraper_config = scraper_config
         self.base_path = f'./data/{scraper_config["config_folder"]}'
         self.path_to_site_configs = f'./{scraper_config["root_folder"]}/{scraper_config["config_folder"]}'
-        self.site_list = scraper_config['site_list']
+        self.site_list = scraper_config['site_list'] if site_list is None else site_list
+        self.shard = shard
+        self.storage_config = scraper_config.get('storage', None) or {}
+        self.scheduler = None
+        self.session = None
+        # Объекты для извлечения ссылок по сайтам (с главной страницы и из ленты новостей)
+        self.link_extractors = {}
+        # Адаптивные интервалы обновления и сглаженная частота появления новых ссылок по сайтам
+        self.site_intervals = {}
+        self.link_yield = {}
+        self.feed_extractors = {}
+        # Индексы ранее найденных ссылок по сайтам
+        self.url_indexes = {}
+        # Индексы скачанных страниц по сайтам (адресация по содержимому)
+        self.page_indexes = {}
+        # Архив сегментов (storage.format: archive)
+        self.segment_archive = None
+        # Политики вежливости по хостам
+        self.host_policies = {}
+        # Состояние главных страниц сайтов для условных запросов: ETag, Last-Modified и хэш содержимого
+        self.main_page_state = {}
+        # Потоковая обработка скачанных статей (см. pipeline.StreamingPipeline)
+        self.pipeline = None
+
+    async def get_session(self):
+        """
+        Возвращает общую для всех загрузок HTTP-сессию, создавая её при первом обращении.
+        Соединения переиспользуются (keep-alive), результаты DNS кэшируются.
+
+        Параметры пула можно задать в конфигурации скрапера в разделе *connection*:
+        limit, limit_per_host, keepalive_timeout, dns_cache_ttl, timeout.
+        """
+        if self.session is None or self.session.closed:
+            connection = self.scraper_config.get('connection', None) or {}
+            connector = aiohttp.TCPConnector(ssl=False,
+                                             limit=connection.get('limit', 100),
+                                             limit_per_host=connection.get('limit_per_host', 4),
+                                             keepalive_timeout=connection.get('keepalive_timeout', 60),
+                                             ttl_dns_cache=connection.get('dns_cache_ttl', 600),
+                                             use_dns_cache=True)
+            timeout = aiohttp.ClientTimeout(total=connection.get('timeout', 60))
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=timeout,
+                                                 headers={'User-Agent': self.scraper_config['user-agent']})
+        return self.session
+
+    async def close(self):
+        """
+        Закрывает общую HTTP-сессию, все открытые в пуле соединения, индексы ссылок и страниц.
+        """
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        for url_index in self.url_indexes.values():
+            url_index.close()
+        self.url_indexes = {}
+        for page_index in self.page_indexes.values():
+            page_index.close()
+        self.page_indexes = {}
+        if self.segment_archive is not None:
+            self.segment_archive.close()
+            self.segment_archive = None
+
+    def host_policy(self, url, site_config):
+        """
+        Возвращает политику вежливости для хоста ссылки, создавая её по настройкам сайта.
+
+        :param str url: Ссылка, для хоста которой требуется политика
+        :param dict site_config: Конфигурация сайта
+        """
+        host = urlparse(url).netloc
+        if host not in self.host_policies:
+            politeness = site_config.get('politeness', None) or {}
+            self.host_policies[host] = HostPolicy(concurrency=politeness.get('concurrency', 2),
+                                                  rate=politeness.get('rate', 0.5),
+                                                  burst=politeness.get('burst', 1))
+        return self.host_policies[host]
+
+    def page_path(self, url, site_config, main_page=False, compressed=True):
+        """
+        Возвращает путь к файлу, в котором будет храниться скачанная HTML-страница.
+
+        :param str url: Ссылка на страницу
+        :param dict site_config: Конфигурация сайта
+        :param bool main_page: Является ли ссылка главной страницей сайта
+        :param bool compressed: Добавлять ли к имени файла расширение алгоритма сжатия
+        """
+        base_folder = self.scraper_config['config_folder']
+        compression = self.storage_config.get('compression', None) if compressed else None
 
-    # session = aiohttp.ClientSession()
-    # session = aiohttp.ClientSession(trust_env=True)
-    # session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False))
+        # Фильтруем данные от http/https и скобок в названии для сохранения в файловой системе
+        http_filter_list = ['https://', 'http://', '/', ' ']
+        for hfl in http_filter_list:
+            url = url.replace(hfl, '')
 
-    # async with current_session.get(url=url, headers=headers) as response:
+        update_time = datetime.now().strftime('%H%M_%d%m%Y')
+        current_date = datetime.now().strftime('%d%m%Y')
+        extension = page_extension(compression)
+        if main_page:
+            return f'./data/{base_folder}/{site_config["folder"]}/main_page/{url}_{update_time}.html{extension}'
+        return f'./data/{base_folder}/{site_config["folder"]}/{current_date}/{url}.html{extension}'
 
     async def download(self, url=None, site_config=None, main_page=False):
         """
-        Скачивает HTML-странницу переданной в *site_config*.
+        Скачивает HTML-странницу переданной в *site_config*. Тело ответа читается частями
+        и сохраняется на диск в кодировке UTF-8, при необходимости со сжатием (раздел *storage*
+        конфигурации скрапера: compression, max_size, chunk_size). При включённом параметре
+        *deduplicate* страницы хранятся по хэшу содержимого и одинаковое содержимое записывается один раз.
+        При *format: archive* страницы дописываются в архив сегментов вместо отдельных файлов.
 
         :param str url: Ссылка которую необходимо скачать и сохранить
         :param dict site_config: Конфигурация сайта
         :param bool main_page: Флаг, который принимает значение True или False, указывая,
             является ли ссылка главной страницей сайта или нет
-        :return: В случае корректно скачанной главной страницы сайта, возвращает папку
-            с названием сайта и путь к скачанному файлу.
+        :return: В случае корректно скачанной страницы возвращает путь к скачанному файлу
+            (для архива сегментов - идентификатор записи). Если главная страница не изменилась
+            с прошлого обновления, возвращает None.
+        """
+        if main_page:
+            result = await self.download_main_page(site_config=site_config)
+            if result is None:
+                return None
+            self.commit_main_page(site_config)
+            return result[0]
+
+        if self.storage_config.get('format', 'files') == 'archive':
+            return await self.download_to_archive(url, site_config)
+
+        compression = self.storage_config.get('compression', None)
+        max_size = self.storage_config.get('max_size', 10 * 1024 * 1024)
+        chunk_size = self.storage_config.get('chunk_size', 64 * 1024)
+        deduplicate = self.storage_config.get('deduplicate', False)
+
+        path = self.page_path(url, site_config)
+        if deduplicate:
+            # Страница сначала пишется во временный файл, а имя получает по хэшу содержимого
+            path = f'{path}.part'
+
+        session = await self.get_session()
+        with track_request(url) as timer:
+            async with session.get(url=url) as response:
+                if not self.check_response(url, response, max_size):
+                    return None
+                try:
+                    content_hash = await self.save_page(path, self.iter_body(response, chunk_size, max_size),
+                                                        compression, timer)
+                except PageTooLarge as exc:
+                    print(f'Page: {url} | {exc}')
+                    return None
+
+        if deduplicate:
+            return await self.store_content(url, site_config, path, content_hash, compression)
+        return path
+
+    async def download_to_archive(self, url, site_config):
+        """
+        Скачивает страницу и дописывает её в архив сегментов (*storage.format: archive*).
+        Страница сжимается по мере чтения и записывается в сегмент одной записью.
+
+        :param str url: Ссылка на страницу
+        :param dict site_config: Конфигурация сайта
+        :return: Идентификатор записи в архиве (путь относительно корня архива).
+        """
+        compression = self.storage_config.get('compression', None)
+        max_size = self.storage_config.get('max_size', 10 * 1024 * 1024)
+        chunk_size = self.storage_config.get('chunk_size', 64 * 1024)
+        deduplicate = self.storage_config.get('deduplicate', False)
+
+        session = await self.get_session()
+        with track_request(url) as timer:
+            async with session.get(url=url) as response:
+                if not self.check_response(url, response, max_size):
+                    return None
+                compressor = page_compressor(compression)
+                content_hash = hashlib.sha1()
+                data = []
+                try:
+                    async for chunk in self.iter_body(response, chunk_size, max_size):
+                        with timer.storing():
+                            content_hash.update(chunk)
+                            data.append(compressor.compress(chunk) if compressor else chunk)
+                except PageTooLarge as exc:
+                    print(f'Page: {url} | {exc}')
+                    return None
+                if compressor:
+                    with timer.storing():
+                        data.append(compressor.flush())
+        content_hash = content_hash.hexdigest()
+
+        archive = self.archive()
+        path = self.page_path(url, site_config, compressed=False)
+        fileid = None
+        if deduplicate:
+            fileid = await asyncio.to_thread(archive.find_hash, content_hash)
+            path = f'{os.path.dirname(path)}/{content_hash}.html'
+        if fileid is None:
+            # Идентификатор записи повторяет путь страницы относительно каталога данных
+            fileid = os.path.relpath(path, self.base_path)
+            await asyncio.to_thread(archive.append, fileid, b''.join(data),
+                                    category=site_config['folder'],
+                                    compression=compression,
+                                    content_hash=content_hash,
+                                    url=url)
+        if deduplicate:
+            self.page_index(site_config).add(url, content_hash, fileid)
+        return fileid
+
+    def archive(self):
+        """
+        Возвращает архив сегментов, общий для всех сайтов конфигурации (*base_path*/archive).
+        """
+        if self.segment_archive is None:
+            segment_size = self.storage_config.get('segment_size', 256 * 1024 * 1024)
+            self.segment_archive = SegmentArchive(f'{self.base_path}/archive',
+                                                  segment_size=segment_size,
+                                                  writer=self.shard)
+        return self.segment_archive
+
+    async def store_content(self, url, site_config, path, content_hash, compression=None):
+        """
+        Переносит скачанную страницу в хранилище с адресацией по содержимому. Если такое
+        содержимое уже сохранялось, временный файл удаляется и возвращается путь к ранее
+        сохранённому файлу.
+
+        :param str url: Ссылка на страницу
+        :param dict site_config: Конфигурация сайта
+        :param str path: Путь к временному файлу со скачанной страницей
+        :param str content_hash: Хэш содержимого страницы
+        :param str compression: Алгоритм сжатия, с которым записан файл
+        :return: Путь к файлу с содержимым страницы.
+        """
+        page_index = self.page_index(site_config)
+        content_path = page_index.content_path(content_hash)
+        if content_path is not None and await aiofiles.os.path.exists(content_path):
+            await aiofiles.os.remove(path)
+        else:
+            content_path = f'{os.path.dirname(path)}/{content_hash}.html{page_extension(compression)}'
+            await aiofiles.os.replace(path, content_path)
+        page_index.add(url, content_hash, content_path)
+        return content_path
+
+    async def download_main_page(self, site_config, url=None, save=True):
+        """
+        Скачивает главную страницу сайта условным запросом с сохранёнными ETag/Last-Modified.
+        Главная страница невелика, поэтому собирается в памяти целиком: это позволяет сравнить
+        хэш содержимого до записи на диск и передать страницу на разбор без повторного чтения.
+
+        :param dict site_config: Конфигурация сайта
+        :param str url: Ссылка на страницу со списком ссылок (по умолчанию - *url* сайта)
+        :param bool save: Сохранять ли страницу на диск
+        :return: Путь к сохранённому файлу (None, если *save* = False) и содержимое страницы
+            в UTF-8 (bytes) или None, если страница не изменилась (ответ 304 или тот же хэш
+            содержимого) или не загружена. Новые ETag/Last-Modified и хэш изменившейся страницы
+            запоминаются только после её обработки (см. *commit_main_page*).
         """
         if url is None:
             url = site_config['url']
-        base_folder = self.scraper_config['config_folder']
-        headers = {'User-Agent': self.scraper_config['user-agent']}
+        compression = self.storage_config.get('compression', None)
+        max_size = self.storage_config.get('max_size', 10 * 1024 * 1024)
+        chunk_size = self.storage_config.get('chunk_size', 64 * 1024)
 
-        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False))
-        async with session as current_session:
-            async with current_session.get(url=url, headers=headers, ssl=False) as response:
-                html_response = await response.text()
+        headers = {}
+        state = self.main_page_state.setdefault((site_config['folder'], url), {})
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
 
-        # Фильтруем данные от http/https и скобок в названии для сохранения в файловой системе
-        http_filter_list = ['https://', 'http://', '/', ' ']
-        for hfl in http_filter_list:
-            url = url.replace(hfl, '')
+        session = await self.get_session()
+        with track_request(url):
+            async with session.get(url=url, headers=headers) as response:
+                state['status'] = response.status
+                if not self.check_response(url, response, max_size):
+                    return None
+                try:
+                    body = b''.join([chunk async for chunk in self.iter_body(response, chunk_size, max_size)])
+                except PageTooLarge as exc:
+                    print(f'Page: {url} | {exc}')
+                    return None
+                validators = {'etag': response.headers.get('ETag'),
+                              'last_modified': response.headers.get('Last-Modified')}
 
-        if response.status == 200:
-            # Указываем путь и название файла, где будет хранится скачанная HTML страница
-            update_time = datetime.now().strftime('%H%M_%d%m%Y')
-            current_date = datetime.now().strftime('%d%m%Y')
-            if main_page:
-                path = f'./data/{base_folder}/{site_config["folder"]}/main_page/{url}_{update_time}.html'
-            else:
-                path = f'./data/{base_folder}/{site_config["folder"]}/{current_date}/{url}.html'
-
-            # Создаём папки для скачиваемых файлов и убеждаемся в их корректности
-            parent = os.path.dirname(path)
-            if not await aiofiles.os.path.exists(parent):
-                await aiofiles.os.makedirs(parent)
-            if not await aiofiles.os.path.isdir(parent):
-                raise ValueError('Пожалуйста, убедитесь что указан каталог, а не файл')
-
-            # Сохраняем полученный результат
-            async with aiofiles.open(path, 'w', encoding='utf-8') as output_file:
-                await output_file.write(html_response)
-            return path
-        else:
-            print(response.status)
-        # except (
-        #         ConnectionResetError,
-        #         aiohttp.ClientOSError,
-        #         aiohttp.ServerDisconnectedError,
-        #         aiohttp.ClientConnectorError
-        # ):
-        #     print(f'Try to reconnect for URL: {url} - after {300} seconds')
-        #     return None
+        content_hash = hashlib.sha1(body).hexdigest()
+        if state.get('content_hash') == content_hash:
+            # Содержимое уже обработано: достаточно запомнить новые ETag/Last-Modified
+            state.update(validators)
+            return None
+        state['pending'] = dict(validators, content_hash=content_hash)
+
+        if not save:
+            return None, body
+        path = self.page_path(url, site_config, main_page=True)
+        await self.save_page(path, [body], compression)
+        return path, body
+
+    def commit_main_page(self, site_config, url=None):
+        """
+        Запоминает ETag/Last-Modified и хэш содержимого главной страницы (ленты новостей) после того,
+        как её снимок сохранён, а ссылки извлечены и добавлены в индекс. Если обработка прервана
+        ошибкой, следующее обновление загрузит и разберёт страницу заново.
+
+        :param dict site_config: Конфигурация сайта
+        :param str url: Ссылка на страницу со списком ссылок (по умолчанию - *url* сайта)
+        """
+        state = self.main_page_state.get((site_config['folder'], url or site_config['url']), {})
+        state.update(state.pop('pending', {}))
+
+    @staticmethod
+    def check_response(url, response, max_size):
+        """
+        Проверяет статус ответа и заявленный размер тела ответа.
+        Ответ 304 (страница не изменилась) не считается ошибкой, но и не обрабатывается.
+        """
+        RESPONSES.labels(host=urlparse(url).netloc, status=response.status).inc()
+        if response.status != 200:
+            if response.status != 304:
+                print(response.status)
+            return False
+        if response.content_length is not None and response.content_length > max_size:
+            print(f'Page: {url} | Size: {response.content_length} exceeds {max_size}')
+            return False
+        return True
+
+    @staticmethod
+    async def iter_body(response, chunk_size, max_size):
+        """
+        Асинхронный генератор, возвращающий тело ответа частями в кодировке UTF-8.
+
+        :param response: Ответ сервера
+        :param int chunk_size: Размер читаемой части в байтах
+        :param int max_size: Максимальный размер тела ответа в байтах
+        """
+        try:
+            charset = codecs.lookup(response.charset or 'utf-8').name
+        except LookupError:
+            charset = 'utf-8'
+        decoder = None
+        if charset != 'utf-8':
+            decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+
+        downloaded_bytes = DOWNLOADED_BYTES.labels(host=urlparse(str(response.url)).netloc)
+        size = 0
+        async for chunk in response.content.iter_chunked(chunk_size):
+            size += len(chunk)
+            downloaded_bytes.inc(len(chunk))
+            if size > max_size:
+                raise PageTooLarge(f'Size exceeds {max_size}')
+            yield decoder.decode(chunk).encode('utf-8') if decoder else chunk
+        if decoder:
+            yield decoder.decode(b'', final=True).encode('utf-8')
+
+    @staticmethod
+    async def save_page(path, chunks, compression=None, timer=None):
+        """
+        Записывает страницу на диск по частям, при необходимости сжимая её.
+        Если запись прервана, частично записанный файл удаляется.
+
+        :param str path: Путь к файлу страницы
+        :param chunks: Части страницы в байтах (итерируемый или асинхронно итерируемый объект)
+        :param str compression: Алгоритм сжатия: None, 'gzip' или 'zstd'
+        :param RequestTimer timer: Учёт времени сжатия и записи при чтении ответа (см. *track_request*)
+        :return: Хэш SHA-1 несжатого содержимого страницы.
+        """
+        if timer is None:
+            timer = RequestTimer()
+        # Создаём папки для скачиваемых файлов и убеждаемся в их корректности
+        parent = os.path.dirname(path)
+        if not await aiofiles.os.path.exists(parent):
+            await aiofiles.os.makedirs(parent, exist_ok=True)
+        if not await aiofiles.os.path.isdir(parent):
+            raise ValueError('Пожалуйста, убедитесь что указан каталог, а не файл')
+
+        if not hasattr(chunks, '__aiter__'):
+            chunks = _aiter(chunks)
+        compressor = page_compressor(compression)
+        content_hash = hashlib.sha1()
+        try:
+            async with aiofiles.open(path, 'wb') as output_file:
+                async for chunk in chunks:
+                    with timer.storing():
+                        content_hash.update(chunk)
+                        await output_file.write(compressor.compress(chunk) if compressor else chunk)
+                if compressor:
+                    with timer.storing():
+                        await output_file.write(compressor.flush())
+        except BaseException:
+            if await aiofiles.os.path.exists(path):
+                await aiofiles.os.remove(path)
+            raise
+        return content_hash.hexdigest()
+
+    def load_site_config(self, site):
+        """
+        Считывает конфигурацию сайта из ./configs/<root_folder>/<config_folder>/<site>.yaml
+
+        :param str site: Название сайта из списка *site_list*
+        """
+        site_config = None
+        with open(f'./configs/{self.path_to_site_configs}/{site}.yaml') as stream:
+            try:
+                site_config = yaml.safe_load(stream)
+            except yaml.YAMLError as exc:
+                print(exc)
+        return site_config.get('site_config')
+
+    def refresh_interval(self, site_config):
+        """
+        Возвращает интервал между обновлениями главной страницы сайта в секундах.
+        В адаптивном режиме возвращается интервал, подобранный по числу новых ссылок.
+
+        :param dict site_config: Конфигурация сайта
+        """
+        interval = self.site_intervals.get(site_config.get('folder', None))
+        if interval is not None:
+            return interval
+        return to_seconds(site_config.get('time_update', 600))
+
+    def adapt_interval(self, site_config, new_links):
+        """
+        Подбирает интервал обновления сайта по числу новых ссылок (адаптивный режим, раздел
+        *adaptive* конфигурации сайта: min_interval, max_interval, target_links, alpha).
+        Частота появления новых ссылок сглаживается экспоненциальным скользящим средним,
+        а интервал выбирается так, чтобы за обновление появлялось около *target_links*
+        новых ссылок, в пределах [min_interval, max_interval].
+
+        :param dict site_config: Конфигурация сайта
+        :param int new_links: Количество новых ссылок, найденных при последнем обновлении
+        """
+        adaptive = site_config.get('adaptive', None)
+        if not adaptive:
+            return
+        name = site_config.get('folder', None)
+        interval = self.refresh_interval(site_config)
+        min_interval = to_seconds(adaptive.get('min_interval', 60))
+        max_interval = to_seconds(adaptive.get('max_interval', 3600))
+        target_links = adaptive.get('target_links', 5)
+        alpha = adaptive.get('alpha', 0.3)
+
+        # Частота появления новых ссылок (ссылок в секунду), сглаженная скользящим средним
+        rate = new_links / interval if interval > 0 else 0
+        link_yield = self.link_yield.get(name)
+        link_yield = rate if link_yield is None else alpha * rate + (1 - alpha) * link_yield
+        self.link_yield[name] = link_yield
+
+        interval = target_links / link_yield if link_yield > 0 else max_interval
+        self.site_intervals[name] = min(max(interval, min_interval), max_interval)
 
     async def start_page_refresh(self, end_time):
         """
         Запускает цикличное обновление главных страниц сайтов, указанных в ./configs/scraper_config_*.yaml
+        Обновления выполняются общим планировщиком (*self.scheduler*), через который можно
+        добавлять и удалять сайты во время работы.
 
         :param datetime end_time: Время окончания обновлений после запуска скрапера.
         """
         if self.site_list is not None:
-            tasks = []
+            scheduler_config = self.scraper_config.get('scheduler', None) or {}
+            self.scheduler = RefreshScheduler(scraper=self,
+                                              end_time=end_time,
+                                              workers=scheduler_config.get('workers', 8),
+                                              jitter=scheduler_config.get('jitter', 0.1))
             for site in self.site_list:
-                # Чтение конфигурации скрапера
-                site_config = None
-                with open(f'./configs/{self.path_to_site_configs}/{site}.yaml') as stream:
-                    try:
-                        site_config = yaml.safe_load(stream)
-                    except yaml.YAMLError as exc:
-                        print(exc)
-                site_config = site_config.get('site_config')
-
-                tasks.append(asyncio.create_task(
-                    self.cycle_page_update(site_config=site_config, end_time_for_updates=end_time)))
+                self.scheduler.add_site(self.load_site_config(site))
 
             # Запуск цикличных обновлений
-            await asyncio.gather(*tasks)
+            try:
+                await self.scheduler.run()
+            finally:
+                await self.close()
         print(end_time)
 
-    async def cycle_page_update(self, site_config, end_time_for_updates):
-        """
-        Асинхронная функция для цикличного обновления отдельно взятого сайта.
-
-        :param dict site_config: Конфигурация сайта (папка для сохранения файла, теги, интервал между обновлениями)
-        :param datetime end_time_for_updates: Время окончания обновлений
-        """
-        # Запуск цикличных обновлений
-        update_again = True
-        while update_again:
-            update_again = await self.page_update(site_config=site_config,
-                                                  end_time_for_updates=end_time_for_updates)
-            # Время обновления главной страницы
-            time_to_update = site_config.get('time_update', 600)
-            refresh_time = int(time_to_update['hours']) * 3600 + \
-                           int(time_to_update['minutes']) * 60 + \
-                           int(time_to_update['seconds'])
-
-            if update_again:
-                await asyncio.sleep(refresh_time)
-        print(f'Page: {site_config["url"]} | Time: {datetime.now()} | {update_again}')
-
     async def page_update(self, site_config, end_time_for_updates):
+        # Загрузка/обновление ленты новостей (RSS/Atom) или карты сайта, если она указана в конфигурации
+        result = None
+        extractor = None
+        feed = site_config.get('feed', None)
+        if feed:
+            try:
+                result = await self.download_main_page(site_config=site_config, url=feed['url'], save=False)
+                if self.main_page_state[(site_config['folder'], feed['url'])].get('status') in (200, 304):
+                    extractor = self.feed_extractor(site_config)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                print(f'Feed: {feed["url"]} | Error: {exc!r}')
+            if extractor is not None and result is not None and not extractor.has_items(result[1]):
+                # Ответ не является лентой: ETag и хэш не сохраняются, лента проверяется при следующем обновлении
+                print(f'Feed: {feed["url"]} | No feed items in response')
+                extractor = None
+            if extractor is None:
+                print(f'Feed: {feed["url"]} | Fallback to main page: {site_config["url"]}')
+
         # Загрузка/обновление главной страницы сайта
-        main_page = await self.download(site_config=site_config,
-                                        main_page=True)
+        url = feed['url'] if extractor is not None else site_config['url']
+        if extractor is None:
+            result = await self.download_main_page(site_config=site_config)
+        if result is None:
+            # Главная страница не изменилась или не загружена: пропускаем разбор и обновление индекса ссылок
+            print(f'Main page site: {site_config["url"]} not updated\nCurrent time: {datetime.now()}')
+            REFRESHES.labels(site=site_config['folder'], result='unchanged').inc()
+            LAST_NEW_LINKS.labels(site=site_config['folder']).set(0)
+            self.adapt_interval(site_config, 0)
+            return datetime.now() < end_time_for_updates
+        main_page, page = result
 
         extracted_links = await self.extract_list_of_pages(main_page=main_page,
-                                                           site_config=site_config)
-        # Скачивание новых страниц
-        await asyncio.sleep(1)
-        for i, link in enumerate(extracted_links):
-            time_to_sleep = random.randint(300, 800) / 100
-            print(f'Page number: {i + 1}\nTime to sleep: {time_to_sleep} \nPage: {link}')
-            await asyncio.sleep(time_to_sleep)
-            await self.download(url=link,
-                                site_config=site_config,
-                                main_page=False)
-        print(f'Main page site: {main_page}\nCurrent time: {datetime.now()}')
+                                                           site_config=site_config,
+                                                           page=page,
+                                                           extractor=extractor)
+        self.commit_main_page(site_config, url)
+        REFRESHES.labels(site=site_config['folder'], result='updated').inc()
+        NEW_LINKS.labels(site=site_config['folder']).inc(len(extracted_links))
+        LAST_NEW_LINKS.labels(site=site_config['folder']).set(len(extracted_links))
+        self.adapt_interval(site_config, len(extracted_links))
+        # Скачивание новых страниц. Разные хосты загружаются параллельно,
+        # нагрузка на каждый хост ограничивается его политикой вежливости
+        results = await asyncio.gather(*[self.polite_download(link=link, number=i + 1, site_config=site_config)
+                                         for i, link in enumerate(extracted_links)],
+                                       return_exceptions=True)
+        for link, result in zip(extracted_links, results):
+            if isinstance(result, Exception):
+                print(f'Page: {link} | Error: {result!r}')
+        print(f'Main page site: {main_page or feed["url"]}\nCurrent time: {datetime.now()}')
         current_time = datetime.now()
         if current_time < end_time_for_updates:
             return True
         else:
             return False
 
-    async def extract_list_of_pages(self, main_page, site_config):
+    async def polite_download(self, link, number, site_config):
+        """
+        Скачивает страницу с учётом политики вежливости её хоста.
+
+        :param str link: Ссылка на страницу
+        :param int number: Порядковый номер страницы в текущем обновлении
+        :param dict site_config: Конфигурация сайта
+        """
+        async with self.host_policy(link, site_config):
+            print(f'Page number: {number}\nPage: {link}')
+            path = await self.download(url=link,
+                                       site_config=site_config,
+                                       main_page=False)
+        if path is not None and self.pipeline is not None:
+            # Если обработка не успевает, ожидание места в очереди замедляет загрузку
+            await self.pipeline.submit(path)
+        return path
+
+    async def extract_list_of_pages(self, main_page, site_config, page=None, extractor=None):
         """
         Извлекает список HTML-страниц, которые необходимо скачать. Ранее загруженные
         страницы фильтруются и не загружаются повторно.
 
         :param str main_page: Путь к главной странице сайта, сохранённая локально.
         :param dict site_config: Конфигурация сайта (папка для сохранения файла, теги, интервал между обновлениями).
+        :param bytes page: Содержимое главной страницы в UTF-8. Если не передано, считывается из *main_page*.
+        :param extractor: Объект для извлечения ссылок (по умолчанию - *LinkExtractor* сайта).
         """
-        # Читаем полученный результат
-        # if main_page:
-        async with aiofiles.open(main_page, 'r', encoding='utf8') as output_file:
-            page = await output_file.read()
-        soup = BeautifulSoup(page, 'lxml')
-
-        # Основные параметры сайта для извлечения ссылок
-        url = site_config.get('url', None)
-        tag = site_config.get('tag', 'a')
-        regular = site_config.get('regular', None)
-        tag_class = site_config.get('tag_class', None)
-        add_page_name = site_config.get('add_page_name', False)
-        https_line = site_config.get('https_line', True)
-        delete_part_of_url = site_config.get('delete_part_of_url', None)
+        if page is None:
+            page = (await asyncio.to_thread(read_page, main_page)).encode('utf-8')
+        if extractor is None:
+            extractor = self.link_extractor(site_config)
 
         # Извлечение необходимых ссылок
-        filtered_href_list = []
-        if regular is not None and tag_class is not None:
-            # С использованием регулярных выражений и тега класса в HTML странице
-            soup_result = soup.find_all(tag, tag_class)
-            href_list = [r.get('href') for r in soup_result if r.get('href') is not None]
-            for hl in href_list:
-                temp = re.findall(regular, hl)
-                if temp:
-                    filtered_href_list.append(temp[0])
-        elif regular is not None:
-            # С использованием регулярных выражений
-            soup_result = soup.find_all(tag)
-            href_list = [r.get('href') for r in soup_result if r.get('href') is not None]
-            for hl in href_list:
-                temp = re.findall(regular, hl)
-                if temp:
-                    filtered_href_list.append(temp[0])
-        elif tag_class is not None:
-            # С использованием тега класса в HTML странице
-            soup_result = soup.find_all(tag, tag_class)
-            href_list = [r.get('href') for r in soup_result if r.get('href') is not None]
-            filtered_href_list = href_list.copy()
+        filtered_href_list = extractor.extract(page)
 
-        # Удаление "лишней" части ссылки (случай с [lenta.ru: /parts/news/])
-        if delete_part_of_url:
-            url = url.replace(delete_part_of_url, '')
-
-        # Добавление исходной ссылки к отфильтрованным, при необходимости.
-        # Например, https://lenta.ru/parts/news и /2020/10/03/something.
-        # Необходимо для [lenta.ru/parts/news]
-        if add_page_name:
-            if https_line:
-                filtered_href_list = [f'{url}{fhl}' for fhl in filtered_href_list]
-            else:
-                filtered_href_list = [f'{fhl}' for fhl in filtered_href_list]
-
-        # Преобразуем к множеству, для удаления дубликатов
-        filtered_href_set = set(filtered_href_list)
-
-        # Исключаем загруженные раннее ссылки, список которых хранится в файле site_data.json
+        # Исключаем найденные раннее ссылки, которые хранятся в индексе ссылок
         # для каждого отдельно взятого сайта
-        site_name = site_config.get('folder', None)
-        path_to_json = f'{self.base_path}/{site_name}/main_page/site_data.json'
-        if await aiofiles.os.path.exists(path_to_json) is True:
-            async with aiofiles.open(path_to_json, 'r', encoding='utf-8') as f:
-                site_data = await f.read()
-            site_data = json.loads(site_data)
-
-            temp_list = site_data['new_page_list'] + site_data['page_list']
-            page_list = set(temp_list)
-            page_to_download = list(filtered_href_set.difference(page_list))
-            page_list = list(page_list)
-        else:
-            page_list = []
-            page_to_download = list(filtered_href_set)
+        url_index = self.url_index(site_config)
+        page_to_download = url_index.filter_new(filtered_href_list)
 
-        await self.update_page_list(path_to_json=path_to_json,
+        await self.update_page_list(url_index=url_index,
                                     main_page_path=main_page,
-                                    page_list=page_list,
                                     page_to_download=page_to_download)
         return page_to_download
-        # else:
-        #     return None
 
-    async def update_page_list(self, path_to_json, main_page_path, page_list, page_to_download):
+    def link_extractor(self, site_config):
+        """
+        Возвращает объект для извлечения ссылок, один раз собранный по конфигурации сайта.
+
+        :param dict site_config: Конфигурация сайта
+        """
+        site_name = site_config.get('folder', None)
+        if site_name not in self.link_extractors:
+            self.link_extractors[site_name] = LinkExtractor(site_config)
+        return self.link_extractors[site_name]
+
+    def page_index(self, site_config):
         """
-        Обновление списка ссылок ранее скачанных и ссылок, которые необходимо скачать.
-        Информация о скачанных HTML-страницах сохраняется в файле site_data.json,
-        рядом со скачанными главными страницами.
+        Возвращает индекс скачанных страниц сайта с адресацией по содержимому.
 
-        :param path_to_json: Путь к файлу с данными сайта по ссылкам (загружены/не загружены).
-        :param main_page_path: Путь, по которому хранится главная страница сайта со ссылками.
-        :param page_list: Список ранее загруженных ссылок.
+        :param dict site_config: Конфигурация сайта
+        """
+        site_name = site_config.get('folder', None)
+        if site_name not in self.page_indexes:
+            self.page_indexes[site_name] = PageIndex(f'{self.base_path}/{site_name}/main_page/page_index.sqlite3')
+        return self.page_indexes[site_name]
+
+    def feed_extractor(self, site_config):
+        """
+        Возвращает объект для извлечения ссылок из ленты новостей или карты сайта.
+
+        :param dict site_config: Конфигурация сайта
+        """
+        site_name = site_config.get('folder', None)
+        if site_name not in self.feed_extractors:
+            self.feed_extractors[site_name] = FeedExtractor(site_config['feed'])
+        return self.feed_extractors[site_name]
+
+    def url_index(self, site_config):
+        """
+        Возвращает индекс ранее найденных ссылок сайта. При первом открытии в индекс
+        импортируются ссылки из файла site_data.json прежнего формата, если он существует.
+
+        :param dict site_config: Конфигурация сайта
+        """
+        site_name = site_config.get('folder', None)
+        if site_name not in self.url_indexes:
+            site_folder = f'{self.base_path}/{site_name}/main_page'
+            url_index = UrlIndex(f'{site_folder}/url_index.sqlite3')
+            url_index.import_site_data(f'{site_folder}/site_data.json')
+            self.url_indexes[site_name] = url_index
+        return self.url_indexes[site_name]
+
+    async def update_page_list(self, url_index, main_page_path, page_to_download):
+        """
+        Добавление новых ссылок в индекс сайта и удаление предыдущего снимка главной страницы.
+
+        :param UrlIndex url_index: Индекс ранее найденных ссылок сайта.
+        :param main_page_path: Путь, по которому хранится главная страница сайта со ссылками
+            (None, если ссылки получены из ленты новостей и снимок не сохранялся).
         :param page_to_download: Список ссылок, которые необходимо скачать
         """
-        json_data = {
-            "updated_main_page": main_page_path,
-            "new_page_list": page_to_download,
-            "page_list": page_list
-        }
-        if await aiofiles.os.path.exists(path_to_json) is True:
-            async with aiofiles.open(path_to_json) as f:
-                content = await f.read()
-            template = json.loads(content)
-            os.remove(template['updated_main_page'])
+        url_index.add(page_to_download)
+        if main_page_path is None:
+            return
+
+        previous_main_page = url_index.get_meta('updated_main_page')
+        if previous_main_page and previous_main_page != main_page_path \
+                and await aiofiles.os.path.exists(previous_main_page):
+            await aiofiles.os.remove(previous_main_page)
+        url_index.set_meta('updated_main_page', main_page_path)
+
+
+# -- Sharded crawling --------------------------------------------------------------------------------------------------
+def shard_sites(site_list, shards, hosts=None):
+    """
+    Распределяет сайты по процессам по хэшу названия хоста. Каждый сайт всегда попадает
+    в один и тот же процесс, поэтому индексы ссылок и страниц сайта изменяет только один процесс,
+    а сайты с общим хостом делят одну политику вежливости (*Scraper.host_policy*).
+
+    :param list site_list: Список сайтов
+    :param int shards: Количество процессов
+    :param dict hosts: Хосты сайтов по названиям (по умолчанию хэшируется название сайта)
+    :return: Список списков сайтов для каждого процесса.
+    """
+    hosts = hosts or {}
+    result = [[] for _ in range(shards)]
+    for site in site_list:
+        result[zlib.crc32(hosts.get(site, site).encode('utf-8')) % shards].append(site)
+    return result
+
+
+def site_hosts(config, site_list):
+    """
+    Возвращает хосты сайтов (по *url* из конфигураций сайтов).
+    """
+    scraper = Scraper(config)
+    return {site: urlparse(scraper.load_site_config(site)['url']).netloc for site in site_list}
+
+
+def crawl(scraper, end_time, shards=1):
+    """
+    Запускает обновление сайтов скрапера, с потоковой обработкой статей,
+    если в конфигурации есть раздел *pipeline*.
+
+    :param int shards: Количество одновременно работающих процессов скрапера (делят между собой
+        процессы потоковой обработки, см. *pipeline.run_pipeline*)
+    """
+    if scraper.scraper_config.get('pipeline', None):
+        from pipeline import run_pipeline
+        asyncio.run(run_pipeline(scraper, end_time=end_time, shards=shards))
+    else:
+        asyncio.run(scraper.start_page_refresh(end_time=end_time))
+
+
+def _run_shard(config, site_list, shard, shards, end_time):
+    crawl(Scraper(config, site_list=site_list, shard=shard), end_time, shards=shards)
+
+
+def run_sharded(config, end_time, processes=None, restart_delay=5):
+    """
+    Запускает обновление сайтов в нескольких процессах. Координатор следит за процессами
+    и перезапускает аварийно завершившиеся процессы до наступления *end_time*.
+
+    :param str config: Путь к конфигурационному файлу для скрапера.
+    :param datetime end_time: Время окончания обновлений.
+    :param int processes: Количество процессов (по умолчанию - *processes* из конфигурации или число ядер).
+    :param float restart_delay: Пауза перед перезапуском процесса в секундах (остальные процессы
+        в это время продолжают отслеживаться).
+    """
+    with open(config, 'r') as stream:
+        scraper_config = yaml.safe_load(stream)
+    if processes is None:
+        processes = scraper_config.get('processes', None) or os.cpu_count() or 1
+    site_list = scraper_config['site_list']
+    shards = [sites for sites in shard_sites(site_list, processes, site_hosts(config, site_list)) if sites]
+
+    context = multiprocessing.get_context('spawn')
+    workers = {}
+    # Время перезапуска аварийно завершившихся процессов
+    restarts = {}
+
+    def start(shard):
+        worker = context.Process(target=_run_shard,
+                                 args=(config, shards[shard], shard, len(shards), end_time),
+                                 name=f'scraper-{shard}')
+        worker.start()
+        workers[shard] = worker
+        print(f'Shard: {shard} | PID: {worker.pid} | Sites: {shards[shard]}')
 
-        # Сохранение в JSON
-        json_data = json.dumps(json_data)
-        async with aiofiles.open(path_to_json, mode='w', encoding='utf-8') as output_file:
-            await output_file.write(json_data)
+    for shard in range(len(shards)):
+        start(shard)
+    try:
+        while (workers or restarts) and datetime.now() < end_time:
+            time.sleep(1)
+            for shard, worker in list(workers.items()):
+                if worker.is_alive():
+                    continue
+                worker.join()
+                del workers[shard]
+                # Код 0 - процесс штатно завершил обновления
+                if worker.exitcode != 0:
+                    print(f'Shard: {shard} | Exit code: {worker.exitcode} | Restart after {restart_delay} seconds')
+                    restarts[shard] = time.monotonic() + restart_delay
+            for shard, restart_at in list(restarts.items()):
+                if time.monotonic() >= restart_at:
+                    del restarts[shard]
+                    start(shard)
+        for worker in workers.values():
+            worker.join(timeout=max(0.0, (end_time - datetime.now()).total_seconds()) + 60)
+    finally:
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
 
 
 if __name__ == "__main__":
@@ -291,5 +1223,8 @@ if __name__ == "__main__":
     minute = 20
     end_time = datetime(year, month, day, hour, minute)
 
-    # Запуск асинхронных функций
-    asyncio.run(scrap.start_page_refresh(end_time=end_time))
+    # Запуск асинхронных функций (в нескольких процессах, если в конфигурации указано processes > 1)
+    if scrap.scraper_config.get('processes', 1) > 1:
+        run_sharded('./configs/scraper_config_base.yaml', end_time=end_time)
+    else:
+        crawl(scrap, end_time=end_time)
@@ -1,27 +1,243 @@
 import asyncio
+import itertools
+import json
+import os
 import uvicorn
-from typing import Union
-from fastapi import FastAPI
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Union
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 
-app = FastAPI()
+from metrics import CONTENT_TYPE, REGISTRY
+
+# Если задан путь к конфигурации скрапера, скрапер запускается вместе с сервером,
+# и его метрики доступны по адресу /metrics
+SCRAPER_CONFIG = os.environ.get('RELOC_SCRAPER_CONFIG')
+
+# Каталоги корпусов, доступных через /corpus: обработанный (.tokens, .pickle) и исходный (HTML).
+# Разбор документов выполняется в пуле из QUERY_WORKERS потоков пакетами по QUERY_BATCH элементов,
+# поэтому большой запрос не блокирует цикл событий и не занимает все потоки пула.
+# Список документов корпусов читается один раз при запуске сервера и не меняется до перезапуска:
+# документы, добавленные позже (скрапером или обработкой), станут доступны после перезапуска сервера,
+# а курсоры страниц (номера документов в этом списке) остаются действительными всё время работы сервера.
+PROCESSED_CORPUS = os.environ.get('RELOC_CORPUS')
+HTML_CORPUS = os.environ.get('RELOC_HTML_CORPUS')
+HTML_CACHE = os.environ.get('RELOC_HTML_CACHE')
+QUERY_WORKERS = int(os.environ.get('RELOC_QUERY_WORKERS', 4))
+QUERY_BATCH = 256
+
+
+def open_corpora():
+    """
+    Открывает корпуса, заданные переменными окружения (обход каталогов - при запуске сервера).
+    """
+    from parser import HTMLCorpusReader, PickledCorpusReader
+    corpora = {}
+    if PROCESSED_CORPUS:
+        corpora['processed'] = PickledCorpusReader(PROCESSED_CORPUS)
+    if HTML_CORPUS:
+        corpora['html'] = HTMLCorpusReader(HTML_CORPUS, cache=HTML_CACHE)
+    return corpora
+
+
+@asynccontextmanager
+async def lifespan(application):
+    task = None
+    if SCRAPER_CONFIG:
+        from scraper import Scraper
+        application.state.scraper = Scraper(SCRAPER_CONFIG)
+        task = asyncio.create_task(application.state.scraper.start_page_refresh(end_time=datetime.max))
+    application.state.executor = ThreadPoolExecutor(QUERY_WORKERS, thread_name_prefix='corpus')
+    application.state.corpora = await asyncio.to_thread(open_corpora)
+    application.state.fileids = {name: frozenset(reader.fileids())
+                                 for name, reader in application.state.corpora.items()}
+    yield
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    application.state.executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# -- Corpus queries ----------------------------------------------------------------------------------------------------
+def processed_units(reader):
+    return {
+        'docs': reader.docs,
+        'paras': reader.paras,
+        'sents': reader.sents,
+        'tagged': reader.tagged,
+        'words': reader.words,
+    }
+
+
+def html_units(reader):
+    def tagged(fileids):
+        for para in reader.tokenize(fileids):
+            for sent in para:
+                yield from sent
+
+    return {
+        'docs': reader.html,
+        'paras': reader.paras,
+        'sents': reader.sents,
+        'tagged': tagged,
+        'words': reader.words,
+    }
+
+
+UNITS = {'processed': processed_units, 'html': html_units}
+
+
+def positioned_items(reader, units, unit, fileids, document=0, item=0, count=None):
+    """
+    Генератор не более *count* пар (позиция, {"fileid": ..., "item": ...}) элементов корпуса по документам
+    в порядке *fileids*, начиная с элемента *item* документа с номером *document*; позиция - пара
+    (номер документа, номер элемента в документе). Документы до *document* не читаются.
+    """
+    extract = units(reader)[unit]
+
+    def items():
+        for index in range(document, len(fileids)):
+            fileid = fileids[index]
+            start = item if index == document else 0
+            for number, value in enumerate(itertools.islice(extract(fileid), start, None), start):
+                yield (index, number), {'fileid': fileid, 'item': value}
+
+    yield from itertools.islice(items(), count)
+
+
+def corpus_items(reader, units, unit, fileids, offset=0, stop=None):
+    """
+    Генератор элементов корпуса {"fileid": ..., "item": ...} по документам в порядке *fileids*,
+    начиная с элемента *offset* и до элемента *stop* (не включая).
+    """
+    items = (record for _, record in positioned_items(reader, units, unit, fileids))
+    yield from itertools.islice(items, offset, stop)
+
+
+def take(iterator, count):
+    return list(itertools.islice(iterator, count))
+
+
+def select(request_app, corpus, unit, fileid, category):
+    """
+    Проверяет параметры запроса и возвращает объект чтения корпуса и список документов.
+    """
+    reader = request_app.state.corpora.get(corpus)
+    if reader is None:
+        raise HTTPException(404, f'Корпус {corpus} не найден')
+    if unit is not None and unit not in UNITS[corpus](reader):
+        raise HTTPException(404, f'Неизвестный вид элементов: {unit}')
+    if fileid and category:
+        raise HTTPException(400, 'Укажите id-файлов или категории (выберите один вариант)')
+    if fileid:
+        missing = [name for name in fileid if name not in request_app.state.fileids[corpus]]
+        if missing:
+            raise HTTPException(404, f'Документы не найдены: {", ".join(missing)}')
+        return reader, fileid
+    if category:
+        unknown = sorted(set(category) - set(reader.categories()))
+        if unknown:
+            raise HTTPException(404, f'Категории не найдены: {", ".join(unknown)}')
+        return reader, reader.fileids(category)
+    return reader, reader.fileids()
+
+
+async def batches(executor, iterator, size=QUERY_BATCH):
+    """
+    Асинхронно возвращает элементы итератора пакетами, выполняя чтение в пуле потоков.
+    Незавершённый итератор закрывается (например, при разрыве соединения клиентом): если
+    задача отменена во время чтения пакета, итератор закрывается после завершения чтения.
+    """
+    loop = asyncio.get_running_loop()
+    future = None
+    try:
+        while True:
+            # Отмена задачи не отменяет чтение, которое уже выполняется в потоке пула
+            future = loop.run_in_executor(executor, take, iterator, size)
+            batch = await asyncio.shield(future)
+            if not batch:
+                return
+            yield batch
+            if len(batch) < size:
+                return
+    finally:
+        if future is not None and not future.done():
+            # Генератор нельзя закрыть, пока он выполняется в другом потоке
+            await asyncio.wait([future])
+            if not future.cancelled():
+                future.exception()
+        await loop.run_in_executor(executor, iterator.close)
 
-# TODO: оптимизировать функционал и код
 
 @app.get("/")
 async def read_root():
-    return {"Hello": "World"}
+    corpora = app.state.corpora
+    return {name: {'documents': len(app.state.fileids[name]), 'units': list(UNITS[name](reader))}
+            for name, reader in corpora.items()}
+
+
+@app.get("/corpus/{corpus}/categories")
+async def corpus_categories(corpus: str):
+    reader, _ = select(app, corpus, None, None, None)
+    return reader.categories()
+
+
+@app.get("/corpus/{corpus}/fileids")
+async def corpus_fileids(corpus: str, category: Union[List[str], None] = Query(None),
+                         offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=100000)):
+    _, fileids = select(app, corpus, None, None, category)
+    page = fileids[offset:offset + limit]
+    return {'total': len(fileids), 'offset': offset, 'items': page,
+            'next': offset + limit if offset + limit < len(fileids) else None}
+
+
+@app.get("/corpus/{corpus}/{unit}")
+async def corpus_page(corpus: str, unit: str, fileid: Union[List[str], None] = Query(None),
+                      category: Union[List[str], None] = Query(None),
+                      cursor: str = Query('0:0', pattern=r'^\d+:\d+$'), limit: int = Query(100, ge=1, le=10000)):
+    """
+    Страница элементов корпуса (docs, paras, sents, tagged, words), начиная с позиции *cursor*
+    вида "номер документа:номер элемента в документе". *next* - курсор следующей страницы
+    (None на последней странице): чтение продолжается с документа, на котором закончилась
+    предыдущая страница, поэтому документы предыдущих страниц не читаются повторно.
+    """
+    reader, fileids = select(app, corpus, unit, fileid, category)
+    document, item = map(int, cursor.split(':'))
+    iterator = positioned_items(reader, UNITS[corpus], unit, fileids, document, item, limit + 1)
+    entries = []
+    async for batch in batches(app.state.executor, iterator, min(limit + 1, QUERY_BATCH)):
+        entries.extend(batch)
+    more = len(entries) > limit
+    return {'cursor': cursor, 'items': [record for _, record in entries[:limit]],
+            'next': '{}:{}'.format(*entries[limit][0]) if more else None}
+
+
+@app.get("/corpus/{corpus}/{unit}/stream")
+async def corpus_stream(corpus: str, unit: str, fileid: Union[List[str], None] = Query(None),
+                        category: Union[List[str], None] = Query(None), offset: int = Query(0, ge=0),
+                        limit: Union[int, None] = Query(None, ge=1)):
+    """
+    Поток элементов корпуса в формате NDJSON: один JSON-объект {"fileid", "item"} на строку.
+    """
+    reader, fileids = select(app, corpus, unit, fileid, category)
+    stop = None if limit is None else offset + limit
+    iterator = corpus_items(reader, UNITS[corpus], unit, fileids, offset, stop)
 
+    async def lines():
+        async for batch in batches(app.state.executor, iterator):
+            yield ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in batch)
 
-@app.get("/func")
-async def check_func():
-    # res = check_hello()
-    # return res
-    return {"func": "todo"}
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
 
 
-@app.get("/items/{item_id}")
-async def read_item(item_id: int, q: Union[str, None] = None):
-    return {"item_id": item_id, "q": q}
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.expose(), media_type=CONTENT_TYPE)
 
 
 async def main():
@@ -0,0 +1,990 @@
+import gzip
+import heapq
+import io
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+from array import array
+from collections import OrderedDict
+
+
+# -- URL index ---------------------------------------------------------------------------------------------------------
+class UrlIndex:
+    """
+    Постоянный индекс ранее найденных ссылок сайта на базе SQLite.
+    Проверка наличия ссылки выполняется по первичному ключу, новые ссылки
+    добавляются построчно без перезаписи всего списка.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: Путь к файлу базы данных индекса
+        """
+        parent = os.path.dirname(path)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, added REAL) WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+    def __contains__(self, url):
+        cursor = self.connection.execute('SELECT 1 FROM urls WHERE url = ?', (url,))
+        return cursor.fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM urls').fetchone()[0]
+
+    def filter_new(self, urls):
+        """
+        Возвращает список ссылок, которых ещё нет в индексе (без дубликатов, порядок сохраняется).
+
+        :param urls: Ссылки для проверки
+        """
+        result = []
+        seen = set()
+        for url in urls:
+            if url not in seen and url not in self:
+                result.append(url)
+            seen.add(url)
+        return result
+
+    def add(self, urls):
+        """
+        Добавляет ссылки в индекс одной транзакцией. Ранее добавленные ссылки игнорируются.
+
+        :param urls: Ссылки для добавления
+        """
+        added = time.time()
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO urls (url, added) VALUES (?, ?)',
+                                        ((url, added) for url in urls))
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key, value):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def import_site_data(self, path_to_json):
+        """
+        Однократно импортирует ссылки из файла site_data.json прежнего формата.
+
+        :param str path_to_json: Путь к файлу site_data.json
+        :return: True, если импорт был выполнен.
+        """
+        if self.get_meta('imported_site_data') or not os.path.exists(path_to_json):
+            return False
+        with open(path_to_json, 'r', encoding='utf-8') as f:
+            site_data = json.load(f)
+        self.add(site_data.get('new_page_list', []) + site_data.get('page_list', []))
+        if site_data.get('updated_main_page'):
+            self.set_meta('updated_main_page', site_data['updated_main_page'])
+        self.set_meta('imported_site_data', path_to_json)
+        return True
+
+    def close(self):
+        self.connection.close()
+
+
+# -- Page index --------------------------------------------------------------------------------------------------------
+class PageIndex:
+    """
+    Индекс скачанных страниц сайта с адресацией по содержимому: каждое уникальное
+    содержимое хранится в одном файле, имя которого - хэш содержимого, а ссылки
+    сопоставляются с хэшем содержимого.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: Путь к файлу базы данных индекса
+        """
+        parent = os.path.dirname(path)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS contents '
+                                '(hash TEXT PRIMARY KEY, path TEXT, added REAL) WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pages '
+                                '(url TEXT PRIMARY KEY, hash TEXT, added REAL) WITHOUT ROWID')
+        self.connection.commit()
+
+    def content_path(self, content_hash):
+        """
+        Возвращает путь к файлу с содержимым по его хэшу (None, если содержимое ещё не сохранялось).
+        """
+        row = self.connection.execute('SELECT path FROM contents WHERE hash = ?', (content_hash,)).fetchone()
+        return row[0] if row is not None else None
+
+    def page_hash(self, url):
+        """
+        Возвращает хэш содержимого, скачанного по ссылке (None, если ссылка не скачивалась).
+        """
+        row = self.connection.execute('SELECT hash FROM pages WHERE url = ?', (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def add(self, url, content_hash, path):
+        """
+        Сопоставляет ссылку с содержимым и регистрирует файл содержимого, если он новый.
+
+        :param str url: Ссылка на страницу
+        :param str content_hash: Хэш содержимого страницы
+        :param str path: Путь к файлу с содержимым
+        """
+        added = time.time()
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO contents (hash, path, added) VALUES (?, ?, ?)',
+                                    (content_hash, path, added))
+            self.connection.execute('INSERT OR REPLACE INTO pages (url, hash, added) VALUES (?, ?, ?)',
+                                    (url, content_hash, added))
+
+    def close(self):
+        self.connection.close()
+
+
+# -- Processing manifest -----------------------------------------------------------------------------------------------
+class ProcessingManifest:
+    """
+    Манифест предварительной обработки корпуса: для каждого обработанного документа
+    хранит путь к результату, размер, время изменения и хэш исходного файла, а также
+    версию конвейера обработки, которой получен результат.
+
+    Манифест можно использовать из нескольких потоков (потоковая обработка проверяет
+    и записывает состояние документов вне цикла событий).
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: Путь к файлу базы данных манифеста
+        """
+        parent = os.path.dirname(path)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        self.path = path
+        self.lock = threading.Lock()
+        # Манифест общий для процессов скрапера и пакетной обработки: ожидаем освобождения блокировки записи
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS outputs (fileid TEXT PRIMARY KEY, target TEXT, '
+                                'size INTEGER, mtime REAL, hash TEXT, version TEXT, processed REAL) WITHOUT ROWID')
+        self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM outputs').fetchone()[0]
+
+    def entries(self):
+        """
+        Возвращает словарь {fileid: (target, size, mtime, hash, version)} по всем документам манифеста.
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT fileid, target, size, mtime, hash, version FROM outputs')
+            return {row[0]: row[1:] for row in rows}
+
+    def get(self, fileid):
+        """
+        Возвращает запись манифеста (target, size, mtime, hash, version) документа (None, если её нет).
+        """
+        with self.lock:
+            return self.connection.execute('SELECT target, size, mtime, hash, version FROM outputs WHERE fileid = ?',
+                                           (fileid,)).fetchone()
+
+    def add(self, fileid, target, size, mtime, content_hash, version):
+        """
+        Записывает (или обновляет) состояние обработанного документа.
+
+        :param str fileid: Идентификатор исходного документа
+        :param str target: Путь к результату обработки
+        :param int size: Размер исходного файла
+        :param float mtime: Время изменения исходного файла
+        :param str content_hash: Хэш содержимого исходного файла
+        :param str version: Версия конвейера обработки
+        """
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (fileid, target, size, mtime, content_hash, version, time.time()))
+
+    def remove(self, fileids):
+        """
+        Удаляет документы из манифеста одной транзакцией.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM outputs WHERE fileid = ?', ((fileid,) for fileid in fileids))
+
+    def close(self):
+        self.connection.close()
+
+
+# -- Corpus manifest ---------------------------------------------------------------------------------------------------
+class CorpusManifest:
+    """
+    Постоянный список файлов корпуса с категориями, размерами и временем изменения
+    на базе SQLite. При обновлении перечитываются только каталоги, время изменения
+    которых отличается от сохранённого (в них добавлялись, удалялись или
+    переименовывались файлы); остальные каталоги берутся из манифеста.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: Путь к файлу базы данных манифеста (не внутри корня корпуса)
+        """
+        parent = os.path.dirname(path)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime REAL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files (fileid TEXT PRIMARY KEY, dir TEXT, category TEXT, '
+                                'size INTEGER, mtime REAL) WITHOUT ROWID')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_dir ON files (dir)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+    def refresh(self, root, pattern, cat_pattern):
+        """
+        Обновляет манифест по содержимому каталога корпуса.
+
+        :param str root: Корень корпуса
+        :param str pattern: Шаблон идентификаторов файлов (как у CorpusReader)
+        :param str cat_pattern: Шаблон, первая группа которого - категория файла
+        :return: Количество перечитанных каталогов
+        """
+        regexp = re.compile(pattern + '$')
+        category_regexp = re.compile(cat_pattern)
+        settings = json.dumps([os.path.abspath(root), pattern, cat_pattern])
+
+        with self.connection:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+            if row is None or row[0] != settings:
+                self.connection.execute('DELETE FROM dirs')
+                self.connection.execute('DELETE FROM files')
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('settings', ?)", (settings,))
+
+            known = {path: mtime for path, mtime in self.connection.execute('SELECT path, mtime FROM dirs')}
+            children = {}
+            for path, parent in self.connection.execute('SELECT path, parent FROM dirs'):
+                children.setdefault(parent, []).append(path)
+
+            seen = set()
+            rescanned = 0
+            stack = ['']
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime = os.stat(os.path.join(root, directory)).st_mtime
+                except FileNotFoundError:
+                    continue
+                seen.add(directory)
+                if known.get(directory) == mtime:
+                    stack.extend(children.get(directory, ()))
+                    continue
+
+                rescanned += 1
+                files = []
+                with os.scandir(os.path.join(root, directory)) as entries:
+                    for entry in entries:
+                        fileid = f'{directory}/{entry.name}' if directory else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name != '.svn':
+                                stack.append(fileid)
+                        elif regexp.match(fileid):
+                            match = category_regexp.match(fileid)
+                            if match is None:
+                                raise ValueError(f'Файл {fileid} не соответствует шаблону категорий {cat_pattern}')
+                            stat = entry.stat()
+                            files.append((fileid, directory, match.group(1), stat.st_size, stat.st_mtime))
+                self.connection.execute('DELETE FROM files WHERE dir = ?', (directory,))
+                self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', files)
+                self.connection.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                                        (directory, directory.rpartition('/')[0] if directory else None, mtime))
+
+            # Каталоги, которых больше нет
+            for directory in set(known) - seen:
+                self.connection.execute('DELETE FROM files WHERE dir = ?', (directory,))
+                self.connection.execute('DELETE FROM dirs WHERE path = ?', (directory,))
+        return rescanned
+
+    def files(self):
+        """
+        Возвращает список файлов (fileid, category), упорядоченный по идентификатору.
+        """
+        return self.connection.execute('SELECT fileid, category FROM files ORDER BY fileid').fetchall()
+
+    def stats(self):
+        """
+        Возвращает словарь {fileid: (size, mtime)} на момент последнего обновления манифеста.
+        """
+        return {row[0]: row[1:] for row in self.connection.execute('SELECT fileid, size, mtime FROM files')}
+
+    def close(self):
+        self.connection.close()
+
+
+# -- Page storage ------------------------------------------------------------------------------------------------------
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def page_compressor(compression=None, level=None):
+    """
+    Возвращает объект потокового сжатия с методами compress() и flush().
+
+    :param str compression: Алгоритм сжатия: None, 'gzip' или 'zstd'
+    :param int level: Уровень сжатия (по умолчанию используется уровень алгоритма)
+    """
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    raise ValueError(f'Неизвестный алгоритм сжатия: {compression}')
+
+
+def page_extension(compression=None):
+    """
+    Возвращает расширение, добавляемое к имени файла страницы при сжатии.
+    """
+    if compression is None:
+        return ''
+    return COMPRESSION_EXTENSIONS[compression]
+
+
+def open_page(path, encoding='utf-8'):
+    """
+    Открывает сохранённую страницу на чтение в текстовом режиме,
+    прозрачно распаковывая её по расширению файла (.gz, .zst).
+
+    :param str path: Путь к файлу страницы
+    :param str encoding: Кодировка, в которой считывается файл
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding=encoding)
+    if path.endswith('.zst'):
+        import zstandard
+        raw = open(path, 'rb')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), encoding=encoding)
+    return open(path, 'r', encoding=encoding)
+
+
+def read_page(path, encoding='utf-8'):
+    """
+    Считывает сохранённую страницу целиком с распаковкой.
+    """
+    with open_page(path, encoding=encoding) as f:
+        return f.read()
+
+
+def decompress_page(data, compression=None):
+    """
+    Распаковывает содержимое страницы, сжатое алгоритмом *compression*.
+    """
+    if compression is None:
+        return data
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f'Неизвестный алгоритм сжатия: {compression}')
+
+
+# -- Segment archive ---------------------------------------------------------------------------------------------------
+RECORD_MAGIC = b'RELOC/1.0 '
+
+
+class SegmentArchive:
+    """
+    Архив страниц в виде сегментов: больших файлов, в которые записи (страницы)
+    только дописываются, и индекса смещений записей на базе SQLite.
+
+    Каждая запись сегмента состоит из строки заголовка ``RELOC/1.0 <JSON>\\n``
+    с метаданными записи, содержимого (каждая запись сжимается отдельно, что
+    сохраняет произвольный доступ) и завершающего перевода строки. По заголовкам
+    индекс можно восстановить, просканировав сегменты (*rebuild_index*).
+    """
+
+    def __init__(self, root, segment_size=256 * 1024 * 1024, writer=None):
+        """
+        :param str root: Каталог архива
+        :param int segment_size: Размер сегмента в байтах, после которого начинается новый сегмент
+        :param str writer: Идентификатор записывающего процесса. Каждый процесс пишет в свои
+            сегменты (segment-<writer>-<номер>.seg), общим остаётся только индекс.
+        """
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.root = root
+        self.segment_size = segment_size
+        self.prefix = f'segment-{writer}-' if writer is not None else 'segment-'
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite3'), check_same_thread=False, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS records (fileid TEXT PRIMARY KEY, category TEXT, '
+                                'segment TEXT, offset INTEGER, length INTEGER, compression TEXT, '
+                                'hash TEXT, url TEXT, added REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS records_position ON records (segment, offset)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS records_hash ON records (hash)')
+        self.connection.commit()
+        self.output = None
+        self.segment = None
+
+    def segments(self, prefix='segment-'):
+        """
+        Возвращает имена файлов сегментов, упорядоченные по имени.
+
+        :param str prefix: Префикс имени сегмента (по умолчанию - сегменты всех процессов)
+        """
+        return sorted(name for name in os.listdir(self.root) if name.startswith(prefix) and name.endswith('.seg'))
+
+    def _next_segment(self):
+        numbers = [int(name[len(self.prefix):-4]) for name in self.segments(self.prefix)
+                   if name[len(self.prefix):-4].isdigit()]
+        return f'{self.prefix}{max(numbers, default=-1) + 1:05d}.seg'
+
+    def _open_output(self, size):
+        # Каждый запуск начинает новый сегмент: запись, оборванная при аварийном завершении,
+        # остаётся в конце предыдущего сегмента и не смещает новые записи
+        if self.output is None or self.output.tell() > 0 and self.output.tell() + size > self.segment_size:
+            if self.output is not None:
+                self.output.close()
+            self.segment = self._next_segment()
+            self.output = open(os.path.join(self.root, self.segment), 'ab')
+        return self.output
+
+    def append(self, fileid, data, category=None, compression=None, content_hash=None, url=None):
+        """
+        Дописывает запись в текущий сегмент и добавляет её в индекс.
+
+        :param str fileid: Идентификатор записи (путь страницы относительно корня корпуса)
+        :param bytes data: Содержимое страницы, уже сжатое алгоритмом *compression*
+        :param str category: Категория записи (по умолчанию - первая часть *fileid*)
+        :param str compression: Алгоритм сжатия содержимого
+        :param str content_hash: Хэш несжатого содержимого
+        :param str url: Ссылка, по которой скачана страница
+        """
+        if category is None:
+            category = fileid.split('/', 1)[0]
+        added = time.time()
+        header = json.dumps({'fileid': fileid, 'category': category, 'length': len(data),
+                             'compression': compression, 'hash': content_hash, 'url': url, 'added': added},
+                            ensure_ascii=False).encode('utf-8')
+        header = RECORD_MAGIC + header + b'\n'
+
+        with self.lock:
+            output = self._open_output(len(header) + len(data) + 1)
+            offset = output.tell() + len(header)
+            output.write(header)
+            output.write(data)
+            output.write(b'\n')
+            output.flush()
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        (fileid, category, self.segment, offset, len(data),
+                                         compression, content_hash, url, added))
+
+    def find_hash(self, content_hash):
+        """
+        Возвращает идентификатор записи с указанным хэшем содержимого (None, если такой нет).
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT fileid FROM records WHERE hash = ? LIMIT 1',
+                                          (content_hash,)).fetchone()
+        return row[0] if row is not None else None
+
+    def records(self, categories=None):
+        """
+        Возвращает список записей индекса (fileid, category, segment, offset, length, compression)
+        в порядке их расположения в сегментах.
+
+        :param categories: Категория или список категорий для отбора записей
+        """
+        query = 'SELECT fileid, category, segment, offset, length, compression FROM records'
+        params = ()
+        if categories is not None:
+            if isinstance(categories, str):
+                categories = [categories]
+            query += f' WHERE category IN ({", ".join("?" * len(categories))})'
+            params = tuple(categories)
+        with self.lock:
+            return self.connection.execute(query + ' ORDER BY segment, offset', params).fetchall()
+
+    def state(self, fileid):
+        """
+        Возвращает (length, added, hash) записи: размер, время добавления и хэш содержимого.
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT length, added, hash FROM records WHERE fileid = ?',
+                                          (fileid,)).fetchone()
+        if row is None:
+            raise KeyError(f'Запись не найдена в архиве: {fileid}')
+        return row
+
+    def read(self, fileids):
+        """
+        Генератор, возвращающий распакованное содержимое записей в порядке *fileids*.
+        Файлы сегментов открываются один раз на весь проход.
+
+        :param fileids: Идентификатор или список идентификаторов записей
+        """
+        if isinstance(fileids, str):
+            fileids = [fileids]
+        handles = {}
+        try:
+            for fileid in fileids:
+                with self.lock:
+                    row = self.connection.execute('SELECT segment, offset, length, compression FROM records '
+                                                  'WHERE fileid = ?', (fileid,)).fetchone()
+                if row is None:
+                    raise KeyError(f'Запись не найдена в архиве: {fileid}')
+                segment, offset, length, compression = row
+                if segment not in handles:
+                    handles[segment] = open(os.path.join(self.root, segment), 'rb')
+                handle = handles[segment]
+                handle.seek(offset)
+                yield decompress_page(handle.read(length), compression)
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+    def rebuild_index(self):
+        """
+        Восстанавливает индекс по заголовкам записей во всех сегментах.
+        """
+        with self.lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM records')
+                for segment in self.segments():
+                    with open(os.path.join(self.root, segment), 'rb') as handle:
+                        while True:
+                            line = handle.readline()
+                            if not line.startswith(RECORD_MAGIC):
+                                break
+                            header = json.loads(line[len(RECORD_MAGIC):])
+                            offset = handle.tell()
+                            handle.seek(header['length'] + 1, os.SEEK_CUR)
+                            self.connection.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                                    (header['fileid'], header['category'], segment, offset,
+                                                     header['length'], header['compression'], header['hash'],
+                                                     header['url'], header['added']))
+
+    def close(self):
+        with self.lock:
+            if self.output is not None:
+                self.output.close()
+                self.output = None
+            self.connection.close()
+
+
+# -- Document cache ----------------------------------------------------------------------------------------------------
+class DocumentCache:
+    """
+    Двухуровневый кэш результатов разбора документов: LRU в памяти и необязательное
+    хранилище на диске на базе SQLite. Значение хранится вместе с хэшем содержимого
+    документа и считается устаревшим, как только содержимое изменилось.
+    """
+
+    def __init__(self, path=None, size=1024):
+        """
+        :param str path: Путь к файлу базы данных кэша (None - только кэш в памяти)
+        :param int size: Количество значений, хранимых в памяти
+        """
+        self.path = path
+        self.size = size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None and self.path is not None:
+            parent = os.path.dirname(self.path)
+            if parent and not os.path.exists(parent):
+                os.makedirs(parent)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS documents (kind TEXT, fileid TEXT, hash TEXT, '
+                                     'value BLOB, PRIMARY KEY (kind, fileid)) WITHOUT ROWID')
+            self._connection.commit()
+        return self._connection
+
+    def _remember(self, key, content_hash, value):
+        self.memory[key] = (content_hash, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def get(self, kind, fileid, content_hash):
+        """
+        Возвращает значение из кэша (None, если значения нет или содержимое документа изменилось).
+
+        :param str kind: Вид значения (например, 'html' или 'paras')
+        :param str fileid: Идентификатор документа
+        :param str content_hash: Хэш текущего содержимого документа
+        """
+        key = (kind, fileid)
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None and item[0] == content_hash:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            row = None
+            if self.connection is not None:
+                row = self.connection.execute('SELECT value FROM documents WHERE kind = ? AND fileid = ? AND hash = ?',
+                                              (kind, fileid, content_hash)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value = json.loads(zlib.decompress(row[0]))
+            self._remember(key, content_hash, value)
+            self.hits += 1
+            return value
+
+    def put(self, kind, fileid, content_hash, value):
+        """
+        Сохраняет значение в памяти и на диске. Значение должно сериализоваться в JSON.
+        """
+        with self.lock:
+            self._remember((kind, fileid), content_hash, value)
+            if self.connection is not None:
+                data = zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+                with self.connection:
+                    self.connection.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)',
+                                            (kind, fileid, content_hash, data))
+
+    def __getstate__(self):
+        # В другой процесс передаются только настройки: соединение открывается заново
+        return {'path': self.path, 'size': self.size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# -- Token store -------------------------------------------------------------------------------------------------------
+TOKENS_MAGIC = b'RELOCTK1'
+TOKENS_HEADER = struct.Struct('=8s5Q')
+
+
+class Vocabulary:
+    """
+    Общий словарь токенов и тегов частей речи обработанного корпуса на базе SQLite.
+    Каждому слову и тегу назначается постоянный числовой идентификатор; словарь
+    пополняется одновременно несколькими процессами обработки и может использоваться
+    из нескольких потоков одного процесса.
+    """
+    KINDS = ('words', 'tags')
+
+    def __init__(self, path):
+        """
+        :param str path: Путь к файлу базы данных словаря
+        """
+        self.path = path
+        self.ids = {kind: {} for kind in self.KINDS}
+        self.lists = {kind: [] for kind in self.KINDS}
+        self.lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            parent = os.path.dirname(self.path)
+            if parent and not os.path.exists(parent):
+                os.makedirs(parent)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            for kind in self.KINDS:
+                self._connection.execute(f'CREATE TABLE IF NOT EXISTS {kind} '
+                                         f'(id INTEGER PRIMARY KEY, item TEXT UNIQUE)')
+            self._connection.commit()
+        return self._connection
+
+    def encode(self, kind, items):
+        """
+        Возвращает идентификаторы элементов словаря, добавляя отсутствующие.
+
+        :param str kind: Вид словаря: 'words' или 'tags'
+        :param list items: Слова или теги
+        """
+        ids = self.ids[kind]
+        missing = list({item for item in items if item not in ids})
+        if missing:
+            with self.lock, self.connection:
+                self.connection.executemany(f'INSERT OR IGNORE INTO {kind} (item) VALUES (?)',
+                                            ((item,) for item in missing))
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = self.connection.execute(f'SELECT item, id FROM {kind} WHERE item IN '
+                                                   f'({", ".join("?" * len(chunk))})', chunk)
+                    ids.update(rows)
+        return [ids[item] for item in items]
+
+    def items(self, kind, max_id=-1):
+        """
+        Возвращает список элементов словаря, индексированный идентификаторами.
+        Список перечитывается, только если в нём нет идентификатора *max_id*.
+        """
+        if max_id >= len(self.lists[kind]) or not self.lists[kind]:
+            with self.lock:
+                rows = self.connection.execute(f'SELECT id, item FROM {kind}').fetchall()
+            items = [None] * (max((row[0] for row in rows), default=-1) + 1)
+            for id_, item in rows:
+                items[id_] = item
+            self.lists[kind] = items
+        return self.lists[kind]
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def write_tokens(path, document, vocabulary):
+    """
+    Записывает документ, размеченный частями речи, в колоночном формате: заголовок
+    и массивы uint32 - идентификаторы слов, идентификаторы тегов, смещения предложений
+    (в токенах) и смещения абзацев (в предложениях). Файл заменяется атомарно.
+
+    :param str path: Путь к файлу документа
+    :param document: Список абзацев, абзац - список предложений, предложение - список пар (слово, тег)
+    :param Vocabulary vocabulary: Словарь корпуса
+    """
+    words, tags = [], []
+    sent_offsets, para_offsets = array('I', [0]), array('I', [0])
+    for para in document:
+        for sent in para:
+            for word, tag in sent:
+                words.append(word)
+                tags.append(tag)
+            sent_offsets.append(len(words))
+        para_offsets.append(len(sent_offsets) - 1)
+
+    word_ids = array('I', vocabulary.encode('words', words))
+    tag_ids = array('I', vocabulary.encode('tags', tags))
+    header = TOKENS_HEADER.pack(TOKENS_MAGIC, len(word_ids), len(sent_offsets) - 1, len(para_offsets) - 1,
+                                max(word_ids, default=0), max(tag_ids, default=0))
+    part = path + '.part'
+    with open(part, 'wb') as f:
+        f.write(header)
+        for column in (word_ids, tag_ids, sent_offsets, para_offsets):
+            column.tofile(f)
+    os.replace(part, path)
+
+
+class TokenDocument:
+    """
+    Документ в колоночном формате (см. *write_tokens*), отображённый в память.
+    Массивы идентификаторов доступны как memoryview без копирования, абзацы,
+    предложения и токены восстанавливаются по смещениям по мере обхода.
+    """
+
+    def __init__(self, path, vocabulary):
+        """
+        :param str path: Путь к файлу документа
+        :param Vocabulary vocabulary: Словарь корпуса
+        """
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_tokens, n_sents, n_paras, max_word, max_tag = TOKENS_HEADER.unpack_from(self.mmap)
+        if magic != TOKENS_MAGIC:
+            self.close()
+            raise ValueError(f'Файл не является документом в колоночном формате: {path}')
+        self.n_tokens, self.n_sents, self.n_paras = n_tokens, n_sents, n_paras
+        self.view = memoryview(self.mmap)
+        self.columns = []
+        offset = TOKENS_HEADER.size
+        for length in (n_tokens, n_tokens, n_sents + 1, n_paras + 1):
+            self.columns.append(self.view[offset:offset + 4 * length].cast('I'))
+            offset += 4 * length
+        self.word_ids, self.tag_ids, self.sent_offsets, self.para_offsets = self.columns
+        self.word_list = vocabulary.items('words', max_word if n_tokens else -1)
+        self.tag_list = vocabulary.items('tags', max_tag if n_tokens else -1)
+
+    def sentence(self, index):
+        start, end = self.sent_offsets[index], self.sent_offsets[index + 1]
+        words, tags = self.word_list, self.tag_list
+        return [(words[w], tags[t]) for w, t in zip(self.word_ids[start:end], self.tag_ids[start:end])]
+
+    def paras(self):
+        for index in range(self.n_paras):
+            yield [self.sentence(sent) for sent in range(self.para_offsets[index], self.para_offsets[index + 1])]
+
+    def sents(self):
+        for index in range(self.n_sents):
+            yield self.sentence(index)
+
+    def tagged(self):
+        words, tags = self.word_list, self.tag_list
+        for w, t in zip(self.word_ids, self.tag_ids):
+            yield words[w], tags[t]
+
+    def words(self):
+        words = self.word_list
+        for w in self.word_ids:
+            yield words[w]
+
+    def close(self):
+        for column in getattr(self, 'columns', ()):
+            column.release()
+        if getattr(self, 'view', None) is not None:
+            self.view.release()
+        self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# -- Word counts -------------------------------------------------------------------------------------------------------
+COUNTS_RECORD = struct.Struct('<HQQ')
+VOCABULARY_MAGIC = b'RELOCVB1'
+VOCABULARY_HEADER = struct.Struct('<8sQQ')
+
+
+def write_counts(path, items):
+    """
+    Записывает последовательность (word, tf, df), упорядоченную по слову, в двоичный файл:
+    для каждой записи - длина слова в байтах, частота, количество документов и само слово.
+    """
+    pack = COUNTS_RECORD.pack
+    with open(path, 'wb') as f:
+        for word, tf, df in items:
+            data = word.encode('utf-8')
+            f.write(pack(len(data), tf, df))
+            f.write(data)
+
+
+def read_counts(path, offset=0):
+    """
+    Генератор записей (word, tf, df) файла, записанного *write_counts*.
+    """
+    size = COUNTS_RECORD.size
+    unpack = COUNTS_RECORD.unpack
+    with open(path, 'rb', buffering=1024 * 1024) as f:
+        f.seek(offset)
+        while True:
+            header = f.read(size)
+            if not header:
+                return
+            length, tf, df = unpack(header)
+            yield f.read(length).decode('utf-8'), tf, df
+
+
+def merge_counts(paths, fan_in=64):
+    """
+    Генератор, объединяющий упорядоченные файлы частот (k-way merge): частоты и количества
+    документов одного слова складываются. Если файлов больше *fan_in*, они предварительно
+    объединяются группами в промежуточные файлы, которые удаляются вместе с исходными.
+    """
+    paths = list(paths)
+    level = 0
+    while len(paths) > fan_in:
+        merged = []
+        for start in range(0, len(paths), fan_in):
+            group = paths[start:start + fan_in]
+            output = f'{group[0]}.merge{level}'
+            write_counts(output, _merge(group))
+            for path in group:
+                os.remove(path)
+            merged.append(output)
+        paths = merged
+        level += 1
+    return _merge(paths)
+
+
+def _merge(paths):
+    current, tf, df = None, 0, 0
+    for word, word_tf, word_df in heapq.merge(*(read_counts(path) for path in paths)):
+        if word != current:
+            if current is not None:
+                yield current, tf, df
+            current, tf, df = word, 0, 0
+        tf += word_tf
+        df += word_df
+    if current is not None:
+        yield current, tf, df
+
+
+def write_vocabulary(path, items, documents, min_count=1):
+    """
+    Записывает словарь корпуса: заголовок (количество слов и документов) и записи
+    (word, tf, df) в формате *write_counts*, исключая слова с частотой меньше *min_count*.
+
+    :return: Количество слов в словаре
+    """
+    part = path + '.part'
+    words = 0
+    with open(part, 'wb') as f:
+        f.write(VOCABULARY_HEADER.pack(VOCABULARY_MAGIC, 0, documents))
+        pack = COUNTS_RECORD.pack
+        for word, tf, df in items:
+            if tf < min_count:
+                continue
+            data = word.encode('utf-8')
+            f.write(pack(len(data), tf, df))
+            f.write(data)
+            words += 1
+        f.seek(0)
+        f.write(VOCABULARY_HEADER.pack(VOCABULARY_MAGIC, words, documents))
+    os.replace(part, path)
+    return words
+
+
+def vocabulary_header(path):
+    """
+    Возвращает (количество слов, количество документов) из заголовка словаря.
+    """
+    with open(path, 'rb') as f:
+        magic, words, documents = VOCABULARY_HEADER.unpack(f.read(VOCABULARY_HEADER.size))
+    if magic != VOCABULARY_MAGIC:
+        raise ValueError(f'Файл не является словарём корпуса: {path}')
+    return words, documents
+
+
+def read_vocabulary(path):
+    """
+    Генератор записей (word, tf, df) словаря, упорядоченных по слову.
+    """
+    vocabulary_header(path)
+    return read_counts(path, VOCABULARY_HEADER.size)
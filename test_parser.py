@@ -0,0 +1,135 @@
+import gzip
+import os
+
+import pytest
+from openpyxl import load_workbook
+
+import parser
+from parser import Exporter, HTMLCorpusReader, PickledCorpusReader, Preprocessor, TOKEN_SYMBOLS, symbol_stripper
+from storage import read_vocabulary
+
+PAGE = '<html><head><title>{0}</title></head><body><p>Текст статьи {0}.</p></body></html>'
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # NLTK открывает файлы корпуса только в разрешённых каталогах (NLTK_DATA наследуется процессами пула)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('NLTK_DATA', os.pathsep.join(filter(None, [os.environ.get('NLTK_DATA'), str(tmp_path)])))
+    return tmp_path
+
+
+def write_page(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if path.endswith('.gz'):
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+# -- HTML_PATTERN ------------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('manifest', [None, 'corpus_manifest.sqlite3'])
+def test_html_reader_ignores_sqlite_and_partial_files(workdir, manifest):
+    write_page('data/lenta.ru/18102026/article.html', PAGE.format(1))
+    write_page('data/lenta.ru/18102026/compressed.html.gz', PAGE.format(2))
+    for name in ['url_index.sqlite3-wal', 'page_index.sqlite3-shm', 'lenta.ru/archive/index.sqlite3-wal',
+                 'lenta.ru/18102026/partial.html.gz.part', 'lenta.ru/18102026/partial.html.part']:
+        os.makedirs(os.path.dirname(f'data/{name}'), exist_ok=True)
+        with open(f'data/{name}', 'wb') as f:
+            f.write(b'\x00\x01binary')
+
+    reader = HTMLCorpusReader('./data', manifest=manifest)
+
+    assert reader.fileids() == ['lenta.ru/18102026/article.html', 'lenta.ru/18102026/compressed.html.gz']
+    assert len(list(reader.paras())) == 2
+
+
+# -- symbol_stripper ---------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('text', [
+    'Текст,\xa0с «символами»!',
+    '⚪\u200b\ufe0f',
+    '•\u2009\u200e',
+    '\U0001f1f5%\U0001f1f9',
+    '\U0001f1f5\U0001f1e6\U0001f1f7\U0001f1f9',
+])
+def test_symbol_stripper_matches_sequential_replace(text):
+    expected = text.replace('\xa0', ' ')
+    for symbol in TOKEN_SYMBOLS:
+        expected = expected.replace(symbol, '')
+
+    assert symbol_stripper(TOKEN_SYMBOLS)(text) == expected
+
+
+# -- Preprocessor ------------------------------------------------------------------------------------------------------
+class SplitPreprocessor(Preprocessor):
+    """
+    Обработчик с разбиением по пробелам вместо токенизатора и модели разметки NLTK.
+    """
+
+    def tokenize(self, fileid):
+        for para in self.corpus.paras(fileids=fileid):
+            yield [[(word, 'S') for word in para.split()]]
+
+
+def test_parallel_transform_processes_every_file_in_shared_folders(workdir):
+    # Соседние документы одного каталога обрабатываются разными процессами, которые одновременно
+    # создают общий каталог результата
+    fileids = [f'lenta.ru/{day:04}/article-{number}.html' for day in range(150) for number in range(4)]
+    for number, fileid in enumerate(fileids):
+        write_page(f'data/{fileid}', PAGE.format(number))
+
+    preprocessor = SplitPreprocessor(HTMLCorpusReader('./data'), target='./processed', manifest='./manifest.sqlite3')
+    targets = list(preprocessor.transform(processes=4, chunksize=1))
+
+    assert preprocessor.errors == {}
+    assert len(targets) == len(fileids)
+    assert len(PickledCorpusReader('./processed').fileids()) == len(fileids)
+
+
+def test_transform_writes_new_format_on_the_same_target(workdir):
+    for number in range(3):
+        write_page(f'data/lenta.ru/18102026/article-{number}.html', PAGE.format(number))
+    reader = HTMLCorpusReader('./data')
+
+    assert len(list(SplitPreprocessor(reader, target='./processed').transform(report_every=0))) == 3
+    targets = list(SplitPreprocessor(reader, target='./processed', format='pickle').transform(report_every=0))
+
+    assert sorted(os.path.basename(target) for target in targets) == [f'article-{number}.pickle' for number in range(3)]
+    assert list(SplitPreprocessor(reader, target='./processed', format='pickle').transform(report_every=0)) == []
+
+
+def test_save_tokens_spills_once_without_threshold(workdir, monkeypatch):
+    for number in range(300):
+        write_page(f'data/lenta.ru/18102026/article-{number}.html', PAGE.format(number))
+    spills = []
+
+    def write_counts(path, items):
+        spills.append(path)
+        parser_write_counts(path, items)
+
+    parser_write_counts = parser.write_counts
+    monkeypatch.setattr(parser, 'write_counts', write_counts)
+    path = Preprocessor(HTMLCorpusReader('./data'), target='./processed').save_tokens()
+
+    assert len(spills) == 1
+    assert {word: (tf, df) for word, tf, df in read_vocabulary(path)}['статьи'] == (300, 300)
+
+
+# -- Exporter ----------------------------------------------------------------------------------------------------------
+def test_xlsx_table_is_rebuilt_after_corpus_grows(workdir):
+    def export(count, **kwargs):
+        for number in range(count):
+            write_page(f'data/lenta.ru/18102026/article-{number}.html', PAGE.format(number))
+        list(SplitPreprocessor(HTMLCorpusReader('./data'), target='./processed').transform(report_every=0))
+        paths = Exporter(PickledCorpusReader('./processed'), './export').xlsx(report_every=0, **kwargs)
+        return [len(list(load_workbook(path).active.values)) - 1 for path in paths]
+
+    assert export(2) == [2]
+    assert export(3) == [3]
+    assert export(3, rows_per_file=2) == [2, 1]
+    assert export(5, rows_per_file=2) == [2, 2, 1]
+    assert export(5, rows_per_file=4) == [4, 1]
+    assert sorted(os.listdir('./export')) == ['resulted_table.xlsx', 'resulted_table_0001.xlsx',
+                                              'resulted_table_0002.xlsx']
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from server import app, batches
+
+
+# -- batches -----------------------------------------------------------------------------------------------------------
+def test_batches_closes_iterator_when_cancelled_during_read():
+    reading = threading.Event()
+    closed = threading.Event()
+
+    def slow_items():
+        try:
+            while True:
+                reading.set()
+                time.sleep(0.05)
+                yield 1
+        finally:
+            closed.set()
+
+    async def consume():
+        async for _ in batches(executor, slow_items(), size=4):
+            pass
+
+    async def main():
+        task = asyncio.create_task(consume())
+        await asyncio.to_thread(reading.wait)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with ThreadPoolExecutor(2) as executor:
+        asyncio.run(main())
+    assert closed.is_set()
+
+
+# -- corpus_page -------------------------------------------------------------------------------------------------------
+class ParasReader:
+    """
+    Корпус из документов с заданным количеством абзацев; запоминает прочитанные документы.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.read = []
+
+    def fileids(self, categories=None):
+        return sorted(self.sizes)
+
+    def paras(self, fileid):
+        self.read.append(fileid)
+        for number in range(self.sizes[fileid]):
+            yield f'{fileid}-{number}'
+
+    docs = sents = tagged = words = paras
+
+
+def test_corpus_page_resumes_from_cursor_document():
+    reader = ParasReader({'a': 3, 'b': 0, 'c': 4, 'd': 1})
+    with TestClient(app) as client:
+        app.state.corpora = {'processed': reader}
+        app.state.fileids = {'processed': frozenset(reader.fileids())}
+        items, cursors, cursor = [], [], '0:0'
+        while cursor is not None:
+            reader.read.clear()
+            page = client.get('/corpus/processed/paras', params={'cursor': cursor, 'limit': 2}).json()
+            items.extend(record['item'] for record in page['items'])
+            cursors.append((cursor, reader.read[0]))
+            cursor = page['next']
+
+        assert client.get('/corpus/processed/paras', params={'cursor': '1'}).status_code == 422
+
+    assert items == ['a-0', 'a-1', 'a-2', 'c-0', 'c-1', 'c-2', 'c-3', 'd-0']
+    assert cursors == [('0:0', 'a'), ('0:2', 'a'), ('2:1', 'c'), ('2:3', 'c')]